@@ -10,6 +10,55 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 app.secret_key = 'your_secret_key'
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Content-addressed cache of contours and KRL scripts, shared by all sessions and workers
+app.config['RESULT_CACHE_FOLDER'] = 'cache'
+app.config['RESULT_CACHE_MAX_BYTES'] = 512 * 1024 * 1024
+
+# Worker processes smoothing the contours of one conversion in parallel (None smooths serially)
+app.config['SMOOTHING_WORKERS'] = None
+
+# Render plots with WebGL, downsampled to the screen resolution (SVG with every point if False)
+app.config['PLOT_WEBGL'] = True
+
+# Worker threads running conversions in the background (0 converts within the request). Jobs are kept in the
+# memory of this process, so the server must run as one process or with sticky sessions, see website/jobs.py
+app.config['JOB_WORKERS'] = 2
+
+# Worker processes evaluating the settings of a parameter sweep (None evaluates them in the job thread)
+app.config['SWEEP_WORKERS'] = os.cpu_count()
+
+# Longest side in pixels of the previews shown while tuning the preprocessing, the full resolution is only
+# processed on conversion (0 processes the full resolution on every change)
+app.config['PREVIEW_MAX_SIZE'] = 800
+
+# Images with at least this many pixels are processed in tiles of TILE_SIZE pixels with bounded memory, using
+# TILE_WORKERS threads (None processes every image as a whole)
+app.config['TILED_MIN_PIXELS'] = 16_000_000
+app.config['TILE_SIZE'] = 1024
+app.config['TILE_WORKERS'] = 4
+
+# Number of undo steps kept per session
+app.config['HISTORY_DEPTH'] = 50
+
+# Motion limits the cycle time of the KRL scripts is estimated with, see website/kuka/simulator.py for the defaults
+app.config['MOTION_LIMITS'] = {
+    'lin_velocity': 250.0,  # mm/s
+    'lin_acceleration': 2000.0,  # mm/s^2
+    'ptp_velocity': 500.0,  # mm/s
+    'ptp_acceleration': 4000.0,  # mm/s^2
+    'approximation': 1.0,  # C_DIS approximation distance in mm
+}
+
+# Contours, KRL scripts and figures of the sessions, which only hold their ids. Artifacts are deleted when they
+# were not used for ARTIFACT_TTL seconds
+app.config['ARTIFACT_FOLDER'] = 'artifacts'
+app.config['ARTIFACT_TTL'] = 7 * 24 * 3600
+
+# Budget of the parts the KRL script is split into for the zip download, in moves and in bytes per part file
+# (None for no limit)
+app.config['KRL_PART_POINTS'] = 10000
+app.config['KRL_PART_BYTES'] = None
+
 # Configure server-side session storage
 app.config['SESSION_TYPE'] = 'filesystem'
 Session(app)
@@ -0,0 +1,213 @@
+"""
+Convert many images to KRL programs in one run.
+
+Every image found in the given directories or glob patterns is converted in
+a pool of worker processes, which import the image processing libraries
+only once. One .src file per image is written to the output directory. A
+manifest in the output directory records the image hash and the options of
+every program, so images whose inputs have not changed are skipped on the
+next run. A summary with the timing, point counts and estimated cycle time
+of every image is printed, and optionally written as CSV or JSON.
+
+Usage: python batch.py <directory|glob> [...] [-o output] [--workers N] [--summary summary.csv]
+"""
+
+import argparse
+import contextlib
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from website.image_stuff import image_conversion, tiled
+from website.kuka import converter, simulator
+from website.result_cache import ResultCache
+
+IMAGE_EXTENSIONS = ('.png', '.jpeg', '.jpg')
+MANIFEST = ".batch_manifest.json"
+SUMMARY_FIELDS = ["image", "output", "status", "contours", "contour_points", "krl_points", "cycle_time", "seconds",
+                  "error"]
+
+
+def find_images(patterns):
+    """The images in the given directories and glob patterns, in order and without duplicates."""
+    images = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = [os.path.join(pattern, name) for name in sorted(os.listdir(pattern))]
+        else:
+            paths = sorted(glob.glob(pattern, recursive=True))
+        images += [path for path in paths if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)]
+    return list(dict.fromkeys(images))
+
+
+def input_key(image_path, options):
+    """Key of everything that affects the program of an image."""
+    return ResultCache.key("batch", image_conversion.image_hash(image_path), **options)
+
+
+def convert_image(image_path, output_path, options):
+    """Convert one image in a worker process and return its summary."""
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if options.get("tile_size"):
+            contours = tiled.process_image_tiled(image_path, options["blur"], options["block_size"], options["c"],
+                                                 backend=options["backend"], tile_size=options["tile_size"])
+        else:
+            contours = image_conversion.process_image(image_path, options["blur"], options["block_size"],
+                                                      options["c"], backend=options["backend"])
+        lines = converter.generate_krl_script(contours, filename=output_path, scale=np.array(options["scale"]),
+                                              border=np.array([options["border"]] * 2), mode=options["mode"],
+                                              step=options["step"], optimize=options["optimize"],
+                                              tolerance=options["tolerance"] or None,
+                                              overlap_tolerance=options.get("overlap_tolerance") or None,
+                                              chain_gap=options.get("chain_gap") or None,
+                                              motion=options.get("motion", "lin"),
+                                              block_cache=None)
+    return {
+        "contours": len(contours),
+        "contour_points": len(contours.coords),
+        "krl_points": sum(line.startswith(("PTP {", "LIN {", "SPL {")) for line in lines),
+        "cycle_time": round(simulator.estimate_program(lines)["total"], 1),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def run_batch(images, output_dir, options, workers=None, force=False):
+    """
+    Convert the images in a process pool and return one summary row per
+    image. Images whose program is up to date are skipped unless ``force``.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+
+    rows = {}
+    tasks = {}
+    outputs = set()
+    for image_path in images:
+        name = os.path.splitext(os.path.basename(image_path))[0] + ".src"
+        output_path = os.path.join(output_dir, name)
+        row = dict.fromkeys(SUMMARY_FIELDS, "")
+        row.update(image=image_path, output=output_path)
+        rows[image_path] = row
+        if output_path in outputs:
+            row.update(status="failed", error=f"another image is also written to {name}")
+            continue
+        outputs.add(output_path)
+        key = input_key(image_path, options)
+        if not force and manifest.get(name, {}).get("key") == key and os.path.exists(output_path):
+            row.update(manifest[name]["summary"], status="skipped")
+            continue
+        tasks[image_path] = (output_path, key)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(convert_image, image_path, output_path, options): image_path
+                   for image_path, (output_path, _) in tasks.items()}
+        for future in as_completed(futures):
+            image_path = futures[future]
+            output_path, key = tasks[image_path]
+            row = rows[image_path]
+            try:
+                summary = future.result()
+            except Exception as e:
+                row.update(status="failed", error=f"{type(e).__name__}: {e}")
+            else:
+                row.update(summary, status="converted")
+                manifest[os.path.basename(output_path)] = {"image": image_path, "key": key, "summary": summary}
+                save_manifest(output_dir, manifest)
+            detail = (f"{row['seconds']} s, {row['krl_points']} points, "
+                      f"cycle time {simulator.format_duration(row['cycle_time'])}"
+                      if row["status"] == "converted" else row["error"])
+            print(f"{row['status']:<9} {image_path}: {detail}")
+
+    return list(rows.values())
+
+
+def write_summary(rows, path):
+    """Write the summary rows as JSON if the path ends with .json, otherwise as CSV."""
+    with open(path, "w", newline="") as f:
+        if path.lower().endswith(".json"):
+            json.dump(rows, f, indent=1)
+        else:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert directories or glob patterns of images to KRL programs.")
+    parser.add_argument("inputs", nargs="+", help="image directories or glob patterns")
+    parser.add_argument("-o", "--output", default="krl", help="output directory for the .src files")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--summary", help="write the summary to this .csv or .json file")
+    parser.add_argument("--force", action="store_true", help="convert images even if they are up to date")
+    parser.add_argument("--blur", type=int, default=5, help="blur intensity (odd)")
+    parser.add_argument("--block-size", type=int, default=11, help="threshold block size (odd)")
+    parser.add_argument("-c", type=int, default=2, help="threshold C")
+    parser.add_argument("--backend", default="skimage", choices=list(image_conversion.CONTOUR_BACKENDS),
+                        help="contour backend")
+    parser.add_argument("--tile-size", type=int, default=0,
+                        help="process the images in tiles of this many pixels to bound the memory (default: whole)")
+    parser.add_argument("--scale", type=float, nargs=2, default=[210, 297], metavar=("X", "Y"),
+                        help="size of the drawing area in mm")
+    parser.add_argument("--border", type=float, default=20, help="border in mm")
+    parser.add_argument("--mode", default="preserve", choices=["preserve", "scale_paper"], help="aspect mode")
+    parser.add_argument("--step", type=float, default=2, help="distance between the drawn points in mm")
+    parser.add_argument("--tolerance", type=float, default=0, help="max deviation for adaptive resampling in mm")
+    parser.add_argument("--optimize", action="store_true", help="optimize the drawing order")
+    parser.add_argument("--overlap-tolerance", type=float, default=0,
+                        help="draw strokes closer than this many mm to another stroke only once")
+    parser.add_argument("--chain-gap", type=float, default=0,
+                        help="draw contours whose ends are at most this many mm apart without lifting the pen")
+    parser.add_argument("--motion", default="lin", choices=list(converter.MOTION_MODES),
+                        help="draw with LIN moves or with one SPLINE block per contour")
+    args = parser.parse_args(argv)
+
+    images = find_images(args.inputs)
+    if not images:
+        print("No images found")
+        return 1
+
+    options = {"blur": args.blur, "block_size": args.block_size, "c": args.c, "backend": args.backend,
+               "scale": args.scale, "border": args.border, "mode": args.mode, "step": args.step,
+               "tolerance": args.tolerance, "optimize": args.optimize}
+    if args.tile_size:
+        options["tile_size"] = args.tile_size
+    if args.overlap_tolerance:
+        options["overlap_tolerance"] = args.overlap_tolerance
+    if args.chain_gap:
+        options["chain_gap"] = args.chain_gap
+    if args.motion != "lin":
+        options["motion"] = args.motion
+    rows = run_batch(images, args.output, options, workers=args.workers, force=args.force)
+
+    counts = {status: sum(row["status"] == status for row in rows) for status in ("converted", "skipped", "failed")}
+    print(", ".join(f"{count} {status}" for status, count in counts.items()))
+    if args.summary:
+        write_summary(rows, args.summary)
+        print(f"Summary saved to '{args.summary}'")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Parity check and benchmark of the contour extraction backends in
+website.image_stuff.image_conversion.
+
+For every backend the contours are extracted from the same thresholded
+image and filtered like process_image does. The check compares the number
+of kept contours, and bounds the max distance of their points to the
+points of all marching squares contours, before filtering. cv2 joins
+pixels that touch only diagonally, so a joined contour can be kept while
+its marching squares pieces are too short and dropped. Against the kept
+contours alone its points are up to 11 px away on webapp.png, although
+every one of them lies on a marching squares contour.
+
+Usage: python -m benchmarks.extraction [image [blur blockSize C]]
+"""
+import sys
+import timeit
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from website.image_stuff import image_conversion
+
+MAX_COUNT_DIFFERENCE = 0.1  # Allowed relative difference of the contour count (diagonal connectivity)
+MAX_DISTANCE = 0.01  # Allowed max distance in pixels of a point to the points of all skimage contours
+
+
+def kept_contours(contours):
+    """The contours process_image keeps: long enough and of one orientation."""
+    return [p for p in contours
+            if len(p) >= 20 and np.sum((p[1:, 0] - p[:-1, 0]) * (p[1:, 1] + p[:-1, 1])) < 0]
+
+
+def benchmark(image_path, blur=9, block_size=7, c=4, number=5):
+    image_edges = image_conversion.threshold_image(image_path, blur, block_size, c)
+    print(f"{image_path}: {image_edges.shape[1]}x{image_edges.shape[0]} pixels")
+
+    all_reference = image_conversion.find_contours_skimage(image_edges)
+    reference = kept_contours(all_reference)
+    reference_tree = cKDTree(np.concatenate(all_reference))
+
+    ok = True
+    for name, backend in image_conversion.CONTOUR_BACKENDS.items():
+        seconds = timeit.timeit(lambda: backend(image_edges), number=number) / number
+        contours = kept_contours(backend(image_edges))
+        distance, _ = reference_tree.query(np.concatenate(contours))
+        count_difference = abs(len(contours) - len(reference)) / len(reference)
+        ok &= count_difference <= MAX_COUNT_DIFFERENCE and distance.max() <= MAX_DISTANCE
+        print(f"  {name:<8} {seconds * 1000:8.2f} ms  {len(contours):5d} contours  "
+              f"distance to skimage: mean {distance.mean():.3f} px, max {distance.max():.3f} px")
+    return ok
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    image_path = args[0] if args else "webapp.png"
+    params = [int(a) for a in args[1:4]]
+    if not benchmark(image_path, *params):
+        print("Backends disagree beyond the allowed tolerance")
+        sys.exit(1)
@@ -0,0 +1,64 @@
+"""
+Benchmark of the KRL parser in website.kuka.plotter against the previous
+line-by-line implementation.
+
+Usage: python -m benchmarks.parser [file.src ...]
+"""
+import sys
+import timeit
+
+import numpy as np
+
+from website.kuka import plotter
+
+
+def legacy_str_to_point(line: str) -> list:
+    point = line[:-1].split("{")[1].split("}")[0]
+    point = [float(p.split(" ")[1]) for p in point.split(", ")]
+    return point
+
+
+def legacy_extract(lines: list) -> list[np.ndarray]:
+    points = []
+
+    for line in lines:
+        if line.startswith("; ----- Contour"):
+            points.append([])
+        elif not "{" in line:
+            continue
+        elif line.startswith('PTP') or line.startswith('LIN'):
+            points[-1].append(legacy_str_to_point(line))
+    points = [np.array(p) for p in points]
+    return points
+
+
+def legacy_extract_file(filename: str) -> list[np.ndarray]:
+
+    with open(filename, 'r') as f:
+        return legacy_extract(f.readlines())
+
+
+def benchmark(filename: str, number: int = 20) -> None:
+    legacy = legacy_extract_file(filename)
+    fast = plotter.extract_file(filename)
+    assert len(legacy) == len(fast) and all(np.array_equal(a, b) for a, b in zip(legacy, fast)), \
+        f"Parsers disagree on {filename}"
+
+    with open(filename, 'r') as f:
+        text = f.read()
+    lines = text.split("\n")
+
+    timings = {
+        "legacy extract_file": timeit.timeit(lambda: legacy_extract_file(filename), number=number),
+        "extract_file (mmap)": timeit.timeit(lambda: plotter.extract_file(filename), number=number),
+        "legacy extract (session script)": timeit.timeit(lambda: legacy_extract(lines), number=number),
+        "extract (session script)": timeit.timeit(lambda: plotter.extract(text), number=number),
+    }
+    print(f"{filename}: {len(fast)} contours, {sum(len(p) for p in fast)} moves")
+    for name, seconds in timings.items():
+        print(f"  {name:<32} {seconds / number * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    for filename in sys.argv[1:] or ["draw.src"]:
+        benchmark(filename)
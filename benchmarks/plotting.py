@@ -0,0 +1,53 @@
+"""
+Benchmark of the SVG and the WebGL rendering modes of website.kuka.plotter.
+
+Both plots of the web interface are built for the contours of an image and
+the KRL program generated from them. For every mode the benchmark reports
+the number of traces and points, the size of the HTML payload sent to the
+browser (without plotly.js) and the time to build and serialize it.
+
+Usage: python -m benchmarks.plotting [image [blur blockSize C]]
+"""
+import contextlib
+import io
+import sys
+import time
+
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from website.image_stuff import image_conversion
+from website.kuka import converter, plotter
+
+
+def render(plot, points, **options):
+    start = time.perf_counter()
+    fig = go.Figure()
+    plot(points, fig=fig, show=False, **options)
+    html = pio.to_html(fig, full_html=False, include_plotlyjs=False)
+    seconds = time.perf_counter() - start
+    num_points = sum(len(trace.x) for trace in fig.data if trace.x is not None)
+    return len(fig.data), num_points, len(html), seconds
+
+
+def benchmark(image_path, blur=9, block_size=7, c=4, number=3):
+    with contextlib.redirect_stdout(io.StringIO()):
+        contours = image_conversion.process_image(image_path, blur, block_size, c)
+        script = "".join(converter.iter_krl_script(contours, block_cache=None))
+    path = plotter.extract(script)
+    print(f"{image_path}: {len(contours)} contours, {len(contours.coords)} points, {len(path.coords)} moves")
+
+    for name, plot, points in [("contours", plotter.plot_cont, contours), ("path", plotter.plot_path, path)]:
+        for mode, webgl in [("svg", False), ("webgl", True)]:
+            results = [render(plot, points, webgl=webgl) for _ in range(number)]
+            traces, num_points, size, _ = results[0]
+            seconds = min(r[3] for r in results)
+            print(f"  {name:<8} {mode:<6} {traces:6d} traces {num_points:8d} points "
+                  f"{size / 1024:9.1f} KiB {seconds * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    image_path = args[0] if args else "webapp.png"
+    params = [int(a) for a in args[1:4]]
+    benchmark(image_path, *params)
@@ -0,0 +1,77 @@
+"""
+Benchmark of the batched contour post-processing in
+website.image_stuff.image_conversion against the previous per-contour loop.
+
+Both implementations filter, smooth, close and flip the same extracted
+contours; the check asserts that their results are numerically equivalent.
+
+Usage: python -m benchmarks.postprocessing [image [blur blockSize C [backend]]]
+"""
+import contextlib
+import io
+import sys
+import timeit
+
+import numpy as np
+
+from website.image_stuff import image_conversion
+
+
+def legacy_postprocess(raw_contours) -> list[np.ndarray]:
+    point_arrays = []
+    for points in raw_contours:
+        if len(points) < 20:
+            continue
+        if np.sum((points[1:, 0] - points[:-1, 0]) * (points[1:, 1] + points[:-1, 1])) >= 0:
+            continue
+        points_smoothed = image_conversion.smooth_contour(points)
+        point_arrays.append(points_smoothed)
+
+    for i, arr in enumerate(point_arrays):
+        first_point = arr[0]
+        last_point = arr[-1]
+        distance = np.sqrt((first_point[0] - last_point[0])**2 + (first_point[1] - last_point[1])**2)
+        if distance > 0.5:
+            new_points = np.linspace(first_point, last_point, int(distance / 0.1))
+            point_arrays[i] = np.insert(arr, -1, new_points[1:], axis=0)
+            point_arrays[i] = np.insert(point_arrays[i], -1, first_point, axis=0)
+        print(f"Done adding points to contour {i+1}, now has length", len(point_arrays[i]))
+
+    mini = np.min([np.min(p) for p in point_arrays])
+    maxi = np.max([np.max(p) for p in point_arrays])
+
+    for p in point_arrays:
+        p[:, 1] = mini + maxi - p[:, 1]
+
+    return point_arrays
+
+
+def benchmark(image_path, blur=9, block_size=7, c=4, backend="skimage", number=5):
+    image_edges = image_conversion.threshold_image(image_path, blur, block_size, c)
+    raw_contours = image_conversion.CONTOUR_BACKENDS[backend](image_edges, level=0.9)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy = legacy_postprocess([p.copy() for p in raw_contours])
+        fast = image_conversion.postprocess_contours(raw_contours)
+        timings = {
+            "legacy loop": timeit.timeit(lambda: legacy_postprocess([p.copy() for p in raw_contours]),
+                                         number=number),
+            "batched": timeit.timeit(lambda: image_conversion.postprocess_contours(raw_contours), number=number),
+        }
+
+    assert len(legacy) == len(fast) and all(a.shape == b.shape and np.allclose(a, b, rtol=0, atol=1e-9)
+                                            for a, b in zip(legacy, fast)), \
+        f"Post-processing results disagree on {image_path}"
+
+    print(f"{image_path} ({backend}): {len(raw_contours)} extracted, {len(fast)} kept contours, "
+          f"{len(fast.coords)} points")
+    for name, seconds in timings.items():
+        print(f"  {name:<12} {seconds / number * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    image_path = args[0] if args else "webapp.png"
+    params = [int(a) for a in args[1:4]]
+    backend = args[4] if len(args) > 4 else "skimage"
+    benchmark(image_path, *params, backend=backend)
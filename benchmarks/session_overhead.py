@@ -0,0 +1,84 @@
+"""
+Benchmark of the per-request overhead of the session.
+
+The filesystem session is unpickled and pickled again on every request. The
+benchmark converts an image in the web app and times a request that only
+reads the visibility of the contours, once with the session as the app
+leaves it and once with the contours, the KRL script and both figures held
+in the session itself, as the app did before the artifact store.
+
+Usage: python -m benchmarks.session_overhead [image [requests]]
+"""
+import contextlib
+import glob
+import io
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+import plotly.express as px
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONVERT_FORM = dict(scale_x='210', scale_y='297', border='20', aspect_mode='preserve', preset_size='a4', base='3',
+                    tool='3', step='2')
+
+
+def session_size(directory):
+    return max((os.path.getsize(path) for path in glob.glob(os.path.join(directory, "*"))), default=0)
+
+
+def legacy_session(image_path, options):
+    """The large session entries of the app before the artifact store."""
+    from website.image_stuff.image_conversion import process_image
+    from website.kuka import converter, plotter
+
+    contours = process_image(image_path, options['blur_intensity'], options['threshold_block_size'],
+                             options['threshold_C'])
+    krl_script = "\n".join(converter.generate_krl_script(contours, save=False, scale=np.array([210.0, 297.0]),
+                                                         border=np.array([20.0, 20.0])))
+    fig_cont, fig_path = px.line(), px.line()
+    plotter.plot_cont(contours, fig=fig_cont, show=False, webgl=True)
+    plotter.plot_path(plotter.extract(krl_script), fig=fig_path, show=False, webgl=True)
+    return {"contours": contours, "krl_script": krl_script,
+            "fig": {"cont": fig_cont.to_json(), "path": fig_path.to_json()}}
+
+
+def benchmark(image_path="webapp.png", requests=200):
+    image_path = os.path.abspath(image_path)
+    sys.path.insert(0, ROOT)
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app as web
+
+            web.app.config.update(JOB_WORKERS=0, PREVIEW_MAX_SIZE=0)
+            client = web.app.test_client()
+            client.get('/kuka/')
+            with open(image_path, 'rb') as f:
+                client.post('/kuka/upload', data={'file': (f, os.path.basename(image_path))},
+                            content_type='multipart/form-data')
+            client.post('/kuka/convert', data=CONVERT_FORM)
+            client.get('/kuka/plot/cont')
+            client.get('/kuka/plot/path')
+            with client.session_transaction() as session:
+                legacy = legacy_session(image_path, session['preprocessing_options'])
+
+        session_dir = os.path.join(directory, "flask_session")
+        timings = {"current": (timeit.timeit(lambda: client.get('/kuka/visibility'), number=requests),
+                               session_size(session_dir))}
+        with client.session_transaction() as session:
+            session.update(legacy)
+        timings["legacy"] = (timeit.timeit(lambda: client.get('/kuka/visibility'), number=requests),
+                             session_size(session_dir))
+        os.chdir(ROOT)
+
+    print(f"{image_path}: {len(legacy['contours'])} contours, {len(legacy['krl_script']) / 1024:.0f} KiB KRL")
+    for name, (seconds, size) in timings.items():
+        print(f"  {name:<8} {seconds / requests * 1000:7.2f} ms per request, session {size / 1024:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    benchmark(args[0] if args else "webapp.png", *[int(a) for a in args[1:2]])
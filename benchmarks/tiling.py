@@ -0,0 +1,62 @@
+"""
+Benchmark of the peak memory of the tiled pipeline in
+website.image_stuff.tiled against process_image.
+
+The image is upscaled to simulate a large scan. Every run happens in a
+fresh process, whose peak resident set size is reported together with the
+peak right before processing, so the imports are not counted.
+
+Usage: python -m benchmarks.tiling [image [upscale [tile_size [workers]]]]
+"""
+import contextlib
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(mode, image_path, tile_size, workers, results):
+    from website.image_stuff import image_conversion, tiled
+
+    baseline = peak_rss_mib()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "whole":
+            contours = image_conversion.process_image(image_path, 9, 7, 4)
+        else:
+            contours = tiled.process_image_tiled(image_path, 9, 7, 4, tile_size=tile_size, workers=workers)
+    results.put((mode, baseline, peak_rss_mib(), time.perf_counter() - start, len(contours), len(contours.coords)))
+
+
+def benchmark(image_path="webapp.png", upscale=4, tile_size=1024, workers=4):
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        large_path = os.path.join(directory, "large.png")
+        with Image.open(image_path) as image:
+            image.resize((image.width * upscale, image.height * upscale), Image.NEAREST).save(large_path)
+            print(f"{image_path} x{upscale}: {image.width * upscale} x {image.height * upscale} pixels")
+
+        results = context.Queue()
+        for mode in ("whole", "tiled"):
+            process = context.Process(target=run, args=(mode, large_path, tile_size, workers, results))
+            process.start()
+            mode, baseline, peak, seconds, count, points = results.get()
+            process.join()
+            print(f"  {mode:<6} peak {peak:8.1f} MiB (+{peak - baseline:7.1f} MiB for processing) "
+                  f"{seconds:6.2f} s, {count} contours, {points} points")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    image_path = args[0] if args else "webapp.png"
+    params = [int(a) for a in args[1:4]]
+    benchmark(image_path, *params)
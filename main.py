@@ -1,12 +1,14 @@
+import shutil
 import sys
 
-from website.kuka import converter
+from website.kuka import converter, simulator
 from website.image_stuff import image_conversion
 
 
 
 if __name__ == "__main__":
     # Example usage: python main.py <image_path> <output_path> <blur_intensity> <threshold_block_size> <threshold_C>
+    #                <backend> <workers>
 
     # Get parameters from command
     print("Command line arguments:", sys.argv)
@@ -19,9 +21,21 @@ if __name__ == "__main__":
     image_path = sys.argv[0]
     print("Image path:", image_path)
 
+    backend = sys.argv[5] if len(sys.argv) > 5 else "skimage"
+    if backend not in image_conversion.CONTOUR_BACKENDS:
+        print(f"Invalid backend: {backend}. Choose from {', '.join(image_conversion.CONTOUR_BACKENDS)}.")
+        sys.exit(1)
+    print("Contour backend:", backend)
+
+    try:
+        workers = int(sys.argv[6]) if len(sys.argv) > 6 else None
+    except ValueError:
+        print(f"Invalid number of workers: {sys.argv[6]}. Smoothing serially.")
+        workers = None
+
     if len(sys.argv) < 3:
         try:
-            contours = image_conversion.process_image(image_path, 5, 11, 2)
+            contours = image_conversion.process_image(image_path, 5, 11, 2, backend=backend)
         except Exception as e:
             print(f"Error processing image: {e}")
             sys.exit(1)
@@ -31,7 +45,7 @@ if __name__ == "__main__":
         # Change the parameters based on command line arguments if provided whilst keeping in mind
         # that the first two arguments are the image path and the script name
 
-        for i in range(2, len(sys.argv)):
+        for i in range(2, min(len(sys.argv), 5)):
             try:
                 params[i - 2] = int(sys.argv[i])
             except ValueError:
@@ -39,7 +53,7 @@ if __name__ == "__main__":
 
         print("Using parameters:", params)
         try:
-            contours = image_conversion.process_image(image_path, *params)
+            contours = image_conversion.process_image(image_path, *params, backend=backend)
         except Exception as e:
             print(f"Error processing image: {e}")
             sys.exit(1)
@@ -50,9 +64,16 @@ if __name__ == "__main__":
     output_path = sys.argv[1] if len(sys.argv) > 1 else "draw.src"
     print("Output path:", output_path)
     try:
-        krl_script = converter.generate_krl_script(contours, filename=output_path, save=True)
-        krl_script_string = "\n".join(krl_script)
-        print("KRL Script:\n", krl_script_string)
+        with open(output_path, "w") as f:
+            for chunk in converter.iter_krl_script(contours, workers=workers):
+                f.write(chunk)
+        # Echo the script once it is written, the converter prints its progress while generating it
+        print("KRL Script:")
+        sys.stdout.flush()
+        with open(output_path) as f:
+            shutil.copyfileobj(f, sys.stdout)
+        print(f"KRL script saved to '{output_path}'")
+        print("Estimated cycle time:", simulator.format_estimate(simulator.estimate_file(output_path)))
     except Exception as e:
         print(f"Error generating KRL script: {e}")
         sys.exit(1)
@@ -0,0 +1,76 @@
+"""
+Try combinations of the preprocessing parameters for one image.
+
+For every combination of blur intensity, threshold block size and threshold
+C the contour count, stroke length and estimated drawing time are printed.
+Thumbnails of the contours can be saved for comparison, and given a stroke
+budget the best setting is picked.
+
+Usage: python sweep.py <image> [--blur 3 5 7] [--block-size 7 11] [-c 2 4] [--target-length 5000]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from website.image_stuff import sweep
+from website.image_stuff.image_conversion import CONTOUR_BACKENDS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep the preprocessing parameters of one image.")
+    parser.add_argument("image", help="the image")
+    parser.add_argument("--blur", type=int, nargs="+", default=[3, 5, 7, 9], help="blur intensities (odd)")
+    parser.add_argument("--block-size", type=int, nargs="+", default=[7, 11, 15], help="threshold block sizes (odd)")
+    parser.add_argument("-c", type=int, nargs="+", default=[2, 4, 6], help="threshold C values")
+    parser.add_argument("--backend", default="skimage", choices=list(CONTOUR_BACKENDS), help="contour backend")
+    parser.add_argument("--scale", type=float, nargs=2, default=[210, 297], metavar=("X", "Y"),
+                        help="size of the drawing area in mm")
+    parser.add_argument("--border", type=float, default=20, help="border in mm")
+    parser.add_argument("--mode", default="preserve", choices=["preserve", "scale_paper"], help="aspect mode")
+    parser.add_argument("--step", type=float, default=2, help="distance between the drawn points in mm")
+    parser.add_argument("--tolerance", type=float, default=0, help="max deviation for adaptive resampling in mm")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--target-length", type=float, help="stroke budget in mm to pick the best setting for")
+    parser.add_argument("--thumbnails", help="directory to save a PNG thumbnail per setting to")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    try:
+        results, best = sweep.sweep(args.image, args.blur, args.block_size, args.c, backend=args.backend,
+                                    scale=args.scale, border=args.border, mode=args.mode, step=args.step,
+                                    tolerance=args.tolerance or None, workers=args.workers,
+                                    thumbnail_size=sweep.THUMBNAIL_SIZE if args.thumbnails else 0,
+                                    target_length=args.target_length)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    print(f"{'blur':>4} {'block':>5} {'C':>3} {'contours':>8} {'points':>7} {'stroke mm':>10} {'travel mm':>10} "
+          f"{'time s':>7}")
+    for r in results:
+        print(f"{r['blur_intensity']:4d} {r['threshold_block_size']:5d} {r['threshold_C']:3d} {r['contours']:8d} "
+              f"{r['points']:7d} {r['stroke_length']:10.0f} {r['travel_length']:10.0f} {r['draw_time']:7.0f}"
+              + ("  <- best" if r is best else ""))
+    if args.target_length is not None and best is None:
+        print("No setting produced any contours")
+
+    if args.thumbnails:
+        os.makedirs(args.thumbnails, exist_ok=True)
+        for r in results:
+            name = f"blur{r['blur_intensity']}_block{r['threshold_block_size']}_c{r['threshold_C']}.png"
+            with open(os.path.join(args.thumbnails, name), "wb") as f:
+                f.write(r["thumbnail"])
+        print(f"Thumbnails saved to '{args.thumbnails}'")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": [{k: v for k, v in r.items() if k != "thumbnail"} for r in results],
+                       "best": results.index(best) if best is not None else None}, f, indent=1)
+        print(f"Results saved to '{args.json}'")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
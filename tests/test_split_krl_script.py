@@ -0,0 +1,46 @@
+import numpy as np
+
+from website.kuka import converter
+
+
+def header():
+    return next(converter.iter_krl_script([]))
+
+
+def resume_program(script, **budget):
+    return dict(converter.split_krl_script(script, **budget))[f"{converter.RESUME_NAME.lower()}.src"]
+
+
+def test_split_without_contours_declares_home():
+    modules = dict(converter.split_krl_script(header() + converter.PROGRAM_FOOTER, max_points=10))
+
+    assert sorted(modules) == ["draw_picture.src", "draw_resume.src"]
+    resume = modules["draw_resume.src"]
+    assert resume.count("POS p_home\n") == 1
+    assert resume.index("POS p_home\n") < resume.index("p_home = {") < resume.index("PTP p_home")
+    assert resume.endswith(converter.PROGRAM_FOOTER)
+
+
+def test_split_declares_home_missing_from_an_edited_header():
+    edited = header().replace("POS p_home\n", "").replace(
+        "p_home = {X 0.00, Y 0.00, Z 10.00, A 0, B 0, C 0}\n", "")
+
+    resume = resume_program(edited + converter.PROGRAM_FOOTER)
+
+    assert resume.count("POS p_home\n") == 1
+    assert resume.index("POS p_home\n") < resume.index("p_home = {") < resume.index("BAS(#initmov")
+
+
+def test_split_keeps_every_contour_block():
+    t = np.linspace(0, 6, 50)
+    circle = np.c_[np.cos(t), np.sin(t)] * 50 + 60
+    script = "".join(converter.iter_krl_script([circle, circle + 100, circle + 200], scale=np.array([210, 297]),
+                                               block_cache=None))
+
+    modules = list(converter.split_krl_script(script, max_points=10))
+
+    parts = [text for name, text in modules if name.startswith("draw_part_")]
+    assert len(parts) == 3
+    blocks = script[script.index("; ----- Contour 1"):-len(converter.PROGRAM_FOOTER)]
+    assert "".join(part.split("()\n", 1)[1][:-len("END\n")] for part in parts) == blocks
+    assert "DRAW_PART_003() ; Contour 3" in resume_program(script, max_points=10)
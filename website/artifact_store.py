@@ -0,0 +1,132 @@
+"""
+A local store for the large artifacts of the web sessions.
+
+The filesystem session is unpickled and pickled again on every request, so
+it only holds the ids of a session's contours, KRL script and figures, and
+the artifacts themselves are kept here. Ids are the hash of the content, so
+an artifact is never modified after it is written and two sessions, or two
+processes, storing the same content share one file. Contours are stored as
+.npy arrays and memory-mapped when read, so a request only pages in the
+points it touches.
+
+Like the result cache, the store only uses atomic file operations and is
+safe to share between several worker processes: files are written to a
+temporary name and renamed into place, and a file removed by another
+process is treated as missing. Reads mark an artifact as used, and
+artifacts not used for longer than their time to live are deleted.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+
+from website.contour_set import ContourSet
+
+ARTIFACT_TTL = 7 * 24 * 3600  # Seconds an artifact is kept after it was last used
+CLEANUP_INTERVAL = 3600  # Min seconds between two cleanups of the store
+
+
+class ArtifactStore:
+
+    def __init__(self, directory: str, ttl: float = ARTIFACT_TTL, cleanup_interval: float = CLEANUP_INTERVAL):
+        self.directory = directory
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, artifact_id: str) -> str:
+        return os.path.join(self.directory, artifact_id[:2], artifact_id)
+
+    def open(self, artifact_id: str):
+        """The artifact opened for binary reading, None if it does not exist."""
+        path = self.path(artifact_id)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return None
+        self._touch(path)
+        return f
+
+    def put(self, data: bytes, suffix: str) -> str:
+        """Store data and return its id."""
+        artifact_id = hashlib.blake2b(data, digest_size=16).hexdigest() + suffix
+        path = self.path(artifact_id)
+        if not self._touch(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        self.maybe_cleanup()
+        return artifact_id
+
+    def get_contours(self, artifact_id: str) -> ContourSet | None:
+        path = self.path(artifact_id)
+        try:
+            contours = ContourSet.open(path)
+        except (OSError, ValueError):
+            return None
+        self._touch(path)
+        return contours
+
+    def put_contours(self, contours: ContourSet) -> str:
+        return self.put(ContourSet.from_list(contours).tobytes(), ".npy")
+
+    def get_text(self, artifact_id: str) -> str | None:
+        f = self.open(artifact_id)
+        if f is None:
+            return None
+        with f:
+            return f.read().decode("utf-8")
+
+    def put_text(self, text: str, suffix: str = ".txt") -> str:
+        return self.put(text.encode("utf-8"), suffix)
+
+    def maybe_cleanup(self) -> None:
+        """Clean up if no process did so within the cleanup interval."""
+        marker = os.path.join(self.directory, ".cleanup")
+        try:
+            if os.stat(marker).st_mtime > time.time() - self.cleanup_interval:
+                return
+        except FileNotFoundError:
+            pass
+        # Another process cleaning up at the same time does no harm, removals of missing files are ignored
+        with open(marker, "w"):
+            pass
+        self.cleanup()
+
+    def cleanup(self) -> None:
+        """Delete the artifacts not used within their time to live, and temporary files left by crashed writers."""
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if path == os.path.join(self.directory, ".cleanup"):
+                    continue
+                try:
+                    mtime = os.stat(path).st_mtime
+                except FileNotFoundError:
+                    continue
+                if mtime < now - (3600 if name.endswith(".tmp") else self.ttl):
+                    self._remove(path)
+
+    @staticmethod
+    def _touch(path: str) -> bool:
+        """Mark an artifact as used, False if it does not exist."""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # Already removed by another process
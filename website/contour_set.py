@@ -0,0 +1,136 @@
+"""
+A compact container for a set of contours.
+
+All points are stored in one flat (N, D) buffer, and contour ``i`` is the
+slice ``offsets[i]:offsets[i + 1]`` of it. Single contours are zero-copy
+views into the buffer, and operations on the whole set, such as scaling,
+are one vectorized operation on the buffer. The same layout also holds
+other per-point data, e.g. the motion type of every parsed KRL move.
+"""
+
+from io import BytesIO
+
+import numpy as np
+
+
+class ContourSet:
+
+    def __init__(self, coords: np.ndarray, offsets: np.ndarray):
+        self.coords = np.asarray(coords)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_list(cls, contours, dtype=None) -> "ContourSet":
+        """Build a set from a sequence of (N, D) arrays. A ContourSet is returned as is."""
+        if isinstance(contours, ContourSet):
+            return contours if dtype is None else contours.astype(dtype)
+        contours = [np.asarray(c, dtype=dtype) for c in contours]
+        offsets = np.zeros(len(contours) + 1, dtype=np.int64)
+        np.cumsum([len(c) for c in contours], out=offsets[1:])
+        coords = np.concatenate(contours) if contours else np.empty((0, 2), dtype=dtype or float)
+        return cls(coords, offsets)
+
+    @classmethod
+    def from_lengths(cls, coords: np.ndarray, lengths) -> "ContourSet":
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(coords, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        """A view of one contour for an integer index, a new set for a slice, index array or mask."""
+        if isinstance(idx, (int, np.integer)):
+            if idx < 0:
+                idx += len(self)
+            if not 0 <= idx < len(self):
+                raise IndexError(f"contour index {idx} out of range")
+            return self.coords[self.offsets[idx]:self.offsets[idx + 1]]
+        return self.select(idx)
+
+    def __iter__(self):
+        for start, end in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.coords[start:end]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self) -> int:
+        return self.coords.nbytes + self.offsets.nbytes
+
+    def contour_index(self) -> np.ndarray:
+        """The index of the contour every point belongs to."""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def select(self, idx) -> "ContourSet":
+        """The contours picked by a slice, an index array or a boolean mask, in that order."""
+        if isinstance(idx, slice):
+            idx = np.arange(len(self))[idx]
+        idx = np.asarray(idx)
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        idx = idx.astype(np.int64)
+
+        lengths = self.lengths[idx]
+        offsets = np.zeros(len(idx) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        gather = np.repeat(self.offsets[idx] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return ContourSet(self.coords[gather], offsets)
+
+    def with_coords(self, coords: np.ndarray) -> "ContourSet":
+        """A set with the same contour layout and new points, e.g. the result of a transformation."""
+        return ContourSet(coords, self.offsets)
+
+    def astype(self, dtype) -> "ContourSet":
+        return self.with_coords(self.coords.astype(dtype))
+
+    def copy(self) -> "ContourSet":
+        return ContourSet(self.coords.copy(), self.offsets.copy())
+
+    def to_list(self) -> list[np.ndarray]:
+        return list(self)
+
+    def save(self, file) -> None:
+        """Write the offsets and the points as two consecutive .npy arrays."""
+        np.save(file, self.offsets)
+        np.save(file, self.coords)
+
+    @classmethod
+    def load(cls, file) -> "ContourSet":
+        offsets = np.load(file)
+        coords = np.load(file)
+        return cls(coords, offsets)
+
+    @classmethod
+    def open(cls, path) -> "ContourSet":
+        """Memory-map a set written by save() to a file, read-only and without reading its points."""
+        arrays = []
+        with open(path, "rb") as f:
+            for _ in range(2):
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                offset = f.tell()
+                size = int(np.prod(shape)) * dtype.itemsize
+                if size == 0:
+                    arrays.append(np.empty(shape, dtype=dtype))
+                else:
+                    arrays.append(np.memmap(path, dtype=dtype, mode="r", shape=shape,
+                                            order="F" if fortran_order else "C", offset=offset))
+                f.seek(offset + size)
+        offsets, coords = arrays
+        return cls(coords, offsets)
+
+    def tobytes(self) -> bytes:
+        buffer = BytesIO()
+        self.save(buffer)
+        return buffer.getvalue()
+
+    @classmethod
+    def frombytes(cls, data: bytes) -> "ContourSet":
+        return cls.load(BytesIO(data))
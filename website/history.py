@@ -0,0 +1,96 @@
+"""
+Undo/redo history of the contours and options of a session.
+
+The history is pickled with the session on every request, so it must stay
+small. Entries do not hold contours: they reference them by the key the
+result cache stores them under, which is derived from the image hash and
+the preprocessing options, so equal contour sets are stored once and can
+be recomputed if the cache has dropped them. The options are stored as
+diffs to the previous entry, and only the options of the current entry are
+kept in full. Undo and redo move a cursor and apply one diff, so a step
+costs the same however long the history is. The number of entries is
+limited, the oldest ones are dropped first.
+"""
+
+import copy
+
+HISTORY_DEPTH = 50  # Max number of entries kept per session
+
+
+def diff(old: dict, new: dict) -> dict:
+    """Changes from old to new options as {group: {key: (old value, new value)}}, None for a missing key."""
+    changes = {}
+    for group in old.keys() | new.keys():
+        before, after = old.get(group, {}), new.get(group, {})
+        changed = {key: (before.get(key), after.get(key)) for key in before.keys() | after.keys()
+                   if before.get(key) != after.get(key)}
+        if changed:
+            changes[group] = changed
+    return changes
+
+
+def apply(options: dict, changes: dict, reverse: bool = False) -> dict:
+    """Options with the changes applied, or reverted if ``reverse``."""
+    options = copy.deepcopy(options)
+    for group, changed in changes.items():
+        values = options.setdefault(group, {})
+        for key, (before, after) in changed.items():
+            value = before if reverse else after
+            if value is None:
+                values.pop(key, None)
+            else:
+                values[key] = value
+    return options
+
+
+class History:
+    """
+    A linear history with a cursor on the current entry. Recording an entry
+    drops the entries after the cursor, which could be redone before.
+    """
+
+    def __init__(self, depth: int = HISTORY_DEPTH):
+        self.depth = depth
+        self.entries = []  # {"contours": key, "changes": diff to the previous entry}
+        self.cursor = -1
+        self.options = {}  # Options of the entry at the cursor
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def record(self, contours_key: str, options: dict) -> None:
+        """Add an entry for the contours stored under ``contours_key`` and the options that produced them."""
+        del self.entries[self.cursor + 1:]
+        changes = diff(self.options, options) if self.entries else {}
+        self.entries.append({"contours": contours_key, "changes": changes})
+        self.options = copy.deepcopy(options)
+        self.cursor = len(self.entries) - 1
+        while len(self.entries) > self.depth:
+            self.entries.pop(0)
+            self.cursor -= 1
+        if self.entries:
+            self.entries[0]["changes"] = {}
+
+    @property
+    def can_undo(self) -> bool:
+        return self.cursor > 0
+
+    @property
+    def can_redo(self) -> bool:
+        return self.cursor < len(self.entries) - 1
+
+    def undo(self) -> tuple[str, dict] | None:
+        """Step back and return the contours key and options of the previous entry, None if there is none."""
+        if not self.can_undo:
+            return None
+        self.options = apply(self.options, self.entries[self.cursor]["changes"], reverse=True)
+        self.cursor -= 1
+        return self.entries[self.cursor]["contours"], copy.deepcopy(self.options)
+
+    def redo(self) -> tuple[str, dict] | None:
+        """Step forward and return the contours key and options of the next entry, None if there is none."""
+        if not self.can_redo:
+            return None
+        self.cursor += 1
+        self.options = apply(self.options, self.entries[self.cursor]["changes"])
+        return self.entries[self.cursor]["contours"], copy.deepcopy(self.options)
@@ -1,9 +1,19 @@
+import hashlib
+
 import cv2
 import numpy as np
 from PIL import ImageOps
 from PIL import Image
 from skimage import measure
 
+from website.contour_set import ContourSet
+from website.image_stuff.stage_cache import StageCache
+
+STAGE_CACHE_BUDGET = 256 * 1024 * 1024  # Memory budget in bytes for the intermediate results of process_image
+STAGE_CACHE = StageCache(STAGE_CACHE_BUDGET)
+
+PREVIEW_MAX_SIZE = 800  # Longer side in pixels images are downscaled to for previews
+
 
 def smooth_contour(contour, window_size=5):
     if len(contour) < window_size:
@@ -20,7 +30,84 @@ def smooth_contour(contour, window_size=5):
 
     return np.stack((smoothed_x, smoothed_y), axis=-1)
 
-def process_image(image_path, blur, blockSize, C):
+def find_contours_skimage(image_edges, level=0.9):
+    """Marching squares contours of the thresholded image as (x, y) point arrays."""
+    return [np.fliplr(contour) for contour in measure.find_contours(image_edges.astype(float), level=level)]
+
+
+# The 8 neighbours of a pixel in the order cv2.findContours sweeps them
+# (counterclockwise on screen, as the y axis points down).
+NEIGHBOURS = np.array([(1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1)])
+NEIGHBOUR_INDEX = np.full((3, 3), -1)
+NEIGHBOUR_INDEX[NEIGHBOURS[:, 1] + 1, NEIGHBOURS[:, 0] + 1] = np.arange(8)
+
+
+def _crossing_table():
+    """
+    For a border pixel entered from neighbour ``a`` and left to neighbour
+    ``b``, the background 4-neighbours passed in between, in sweep order.
+    These are the pixel edges marching squares puts a contour point on.
+    """
+    counts = np.zeros((8, 8), dtype=int)
+    offsets = np.zeros((8, 8, 4, 2))
+    for a in range(8):
+        for b in range(8):
+            # Sweep from the neighbour after a up to the one before b.
+            swept = np.arange(a + 1, a + ((b - a - 1) % 8) + 1) % 8
+            passed = [NEIGHBOURS[d] for d in swept if d % 2 == 0]
+            counts[a, b] = len(passed)
+            offsets[a, b, :len(passed)] = np.reshape(passed, (-1, 2))
+    return counts, offsets
+
+
+CROSSING_COUNTS, CROSSING_OFFSETS = _crossing_table()
+
+
+def find_contours_opencv(image_edges, level=0.9):
+    """
+    Border following contours of the thresholded image as (x, y) point arrays.
+
+    cv2.findContours only traces the centers of the border pixels. For
+    sub-pixel accuracy every border pixel is replaced by the points where the
+    iso-line at ``level`` crosses its edges to the background, which are the
+    points marching squares finds. The contours are oriented like the ones of
+    the marching squares backend. Unlike marching squares, foreground pixels
+    touching only diagonally are traced as one contour.
+    """
+    raw_contours, _ = cv2.findContours((image_edges > level).astype(np.uint8), cv2.RETR_LIST,
+                                       cv2.CHAIN_APPROX_NONE)
+    offset = 1 - level / max(float(image_edges.max()), 1.0)
+
+    contours = []
+    for contour in raw_contours:
+        pixels = contour[:, 0, :]
+        if len(pixels) == 1:
+            # A single pixel: all four of its edges.
+            points = pixels + offset * NEIGHBOURS[::2]
+        else:
+            back = np.roll(pixels, 1, axis=0) - pixels
+            ahead = np.roll(pixels, -1, axis=0) - pixels
+            entered = NEIGHBOUR_INDEX[back[:, 1] + 1, back[:, 0] + 1]
+            left = NEIGHBOUR_INDEX[ahead[:, 1] + 1, ahead[:, 0] + 1]
+            passed = np.arange(4) < CROSSING_COUNTS[entered, left][:, None]
+            points = (pixels[:, None, :] + offset * CROSSING_OFFSETS[entered, left])[passed]
+        points = points[::-1]
+        contours.append(np.vstack((points, points[:1])))
+    return contours
+
+
+CONTOUR_BACKENDS = {
+    "skimage": find_contours_skimage,
+    "opencv": find_contours_opencv,
+}
+
+
+def image_hash(image_path):
+    with open(image_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_grayscale(image_path):
     image = Image.open(image_path).convert("RGBA")
     image = ImageOps.expand(image, border=20)
 
@@ -28,9 +115,11 @@ def process_image(image_path, blur, blockSize, C):
     pil_image = Image.alpha_composite(white_bg, image)
 
     image_np = np.array(pil_image)
-    image_grayscale = cv2.cvtColor(image_np, cv2.COLOR_BGR2GRAY)
-    image_blur = cv2.medianBlur(image_grayscale, blur)
-    image_edges = cv2.adaptiveThreshold(
+    return cv2.cvtColor(image_np, cv2.COLOR_BGR2GRAY)
+
+
+def threshold(image_blur, blockSize, C):
+    return cv2.adaptiveThreshold(
         image_blur,
         255,
         cv2.ADAPTIVE_THRESH_MEAN_C,
@@ -39,43 +128,186 @@ def process_image(image_path, blur, blockSize, C):
         C=C
     )
 
-    raw_contours = measure.find_contours(image_edges.astype(float), level=0.9)
-    point_arrays = []
-    for contour in raw_contours:
-        points = np.fliplr(contour)
-        if len(points) < 20:
-            continue
-        if np.sum((points[1:, 0] - points[:-1, 0]) * (points[1:, 1] + points[:-1, 1])) >= 0:
-            continue
-        points_smoothed = smooth_contour(points)
-        point_arrays.append(points_smoothed)
-
-    # Interpolate the last point to the first point
-    for i, arr in enumerate(point_arrays):
-        # print(f"Processing contour {i+1} with length", len(point_arrays[i]))
-        first_point = arr[0]
-        # print(first_point)
-        last_point = arr[-1]
-        # print(last_point)
-        # Calculate the distance between the first and last point
-
-        distance = np.sqrt((first_point[0] - last_point[0])**2 + (first_point[1] - last_point[1])**2)
-        # print(distance)
-        # If the distance is greater than 0.5, interpolate a new point
-        if distance > 0.5:
-            # Calculate points along the line between the first and last point with step size 10 % of distance
-            new_points = np.linspace(first_point, last_point, int(distance / 0.1))
-            # Insert the new points after the last point
-            point_arrays[i] = np.insert(arr, -1, new_points[1:], axis=0)
-            # Add first point again to close the contour
-            point_arrays[i] = np.insert(point_arrays[i], -1, first_point, axis=0)
-
-        print(f"Done adding points to contour {i+1}, now has length", len(point_arrays[i]))
-
-    mini = np.min([np.min(p) for p in point_arrays])
-    maxi = np.max([np.max(p) for p in point_arrays])
-
-    for p in point_arrays:
-        p[:, 1] = mini + maxi - p[:, 1]
-
-    return point_arrays
+
+def threshold_image(image_path, blur, blockSize, C, digest=None, progress=None):
+    """
+    Load, blur and threshold an image. Every stage is cached under the image
+    hash and the parameters it depends on, the results must not be modified.
+    ``progress(stage, fraction)`` is called after the load and threshold stages.
+    """
+    if digest is None:
+        digest = image_hash(image_path)
+    image_grayscale = STAGE_CACHE.get("load", (digest,), lambda: load_grayscale(image_path))
+    if progress:
+        progress("load", 1.0)
+    image_blur = STAGE_CACHE.get("blur", (digest, blur), lambda: cv2.medianBlur(image_grayscale, blur))
+    if progress:
+        progress("threshold", 0.5)
+    image_edges = STAGE_CACHE.get("threshold", (digest, blur, blockSize, C),
+                                  lambda: threshold(image_blur, blockSize, C))
+    if progress:
+        progress("threshold", 1.0)
+    return image_edges
+
+
+def orientation(contours):
+    """Per contour sum of (x[i+1] - x[i]) * (y[i+1] + y[i]), negative for one orientation."""
+    x, y = contours.coords[:, 0], contours.coords[:, 1]
+    terms = np.zeros(len(contours.coords))
+    terms[:-1] = (x[1:] - x[:-1]) * (y[1:] + y[:-1])
+    # Drop the pairs spanning two contours, the segment sums then ignore them.
+    terms[contours.offsets[1:-1] - 1] = 0
+    return np.add.reduceat(terms, contours.offsets[:-1]) if len(contours) else np.zeros(0)
+
+
+def smooth_contours(contours, window_size=5):
+    """smooth_contour applied to every contour of a ContourSet at once."""
+    pad = window_size // 2
+    contour_idx = contours.contour_index()
+    starts = contours.offsets[:-1][contour_idx]
+    ends = contours.offsets[1:][contour_idx] - 1
+
+    # Moving average with the edge points repeated, as np.pad(mode='edge') does.
+    window = np.clip(np.arange(len(contours.coords))[:, None] + np.arange(-pad, pad + 1), starts[:, None],
+                     ends[:, None])
+    kernel = np.ones(window_size) / window_size
+    smoothed = np.sum(contours.coords[window] * kernel[:, None], axis=1)
+
+    short = (contours.lengths < window_size)[contour_idx]
+    smoothed[short] = contours.coords[short]
+    return contours.with_coords(smoothed)
+
+
+def close_contours(contours, max_gap=0.5, spacing=0.1):
+    """
+    Fill the gap between the last and the first point of every contour with
+    points every ``spacing`` pixels if it is wider than ``max_gap``. The new
+    points and the first point are inserted before the last point.
+    """
+    lengths = contours.lengths
+    first = contours.coords[contours.offsets[:-1]]
+    last = contours.coords[contours.offsets[1:] - 1]
+    distance = np.sqrt((first[:, 0] - last[:, 0])**2 + (first[:, 1] - last[:, 1])**2)
+
+    closed = np.flatnonzero(distance > max_gap)
+    num = (distance[closed] / spacing).astype(np.int64)
+    # A gap gets the points of np.linspace(first, last, num)[1:] and the first point.
+    count = np.zeros(len(contours), dtype=np.int64)
+    count[closed] = np.maximum(num - 1, 0)
+    inserted = count.copy()
+    inserted[closed] += 1
+    result = ContourSet.from_lengths(np.empty((len(contours.coords) + inserted.sum(), 2)), lengths + inserted)
+    offsets = result.offsets
+
+    # The original points keep their order, the last one moves to the end.
+    contour_idx = contours.contour_index()
+    local = np.arange(len(contours.coords)) - contours.offsets[:-1][contour_idx]
+    dest = offsets[:-1][contour_idx] + local
+    is_last = local == lengths[contour_idx] - 1
+    dest[is_last] = offsets[1:][contour_idx[is_last]] - 1
+    result.coords[dest] = contours.coords
+
+    # Gap points k = 1 .. num - 1, computed like np.linspace does.
+    gap_idx = np.repeat(np.arange(len(contours)), count)
+    k = np.arange(len(gap_idx)) - np.repeat(np.cumsum(count) - count, count) + 1
+    step = (last - first) / np.maximum(count, 1)[:, None]
+    gap_points = k[:, None] * step[gap_idx] + first[gap_idx]
+    at_end = k == count[gap_idx]
+    gap_points[at_end] = last[gap_idx[at_end]]
+    result.coords[offsets[:-1][gap_idx] + lengths[gap_idx] - 2 + k] = gap_points
+    result.coords[offsets[1:][closed] - 2] = first[closed]
+    return result
+
+
+def postprocess_contours(raw_contours, stats=None):
+    """
+    Filter extracted contours by length and orientation, then smooth, close
+    and flip them upside down. Every step works on all contours at once.
+    If a stats dict is given, the number of contours that had to be closed
+    is stored in it as "closed", for the caller to report.
+    """
+    contours = ContourSet.from_list(raw_contours)
+    contours = contours.select(contours.lengths >= 20)
+    contours = contours.select(orientation(contours) < 0)
+
+    contours = smooth_contours(contours)
+    lengths = contours.lengths
+    contours = close_contours(contours)
+    if stats is not None:
+        stats["closed"] = np.count_nonzero(contours.lengths != lengths)
+
+    mini = np.min(contours.coords)
+    maxi = np.max(contours.coords)
+    contours.coords[:, 1] = mini + maxi - contours.coords[:, 1]
+
+    return contours
+
+
+def extract_contours(image_edges, backend="skimage", stats=None):
+    return postprocess_contours(CONTOUR_BACKENDS[backend](image_edges, level=0.9), stats)
+
+
+def process_image(image_path, blur, blockSize, C, backend="skimage", progress=None):
+    """
+    Contours of an image as a ContourSet. ``progress(stage, fraction)`` is
+    called as the load, threshold and extract stages complete.
+    """
+    digest = image_hash(image_path)
+    image_edges = threshold_image(image_path, blur, blockSize, C, digest=digest, progress=progress)
+    stats = {}
+    point_arrays = STAGE_CACHE.get("contours", (digest, blur, blockSize, C, backend),
+                                   lambda: extract_contours(image_edges, backend, stats))
+    if progress:
+        progress("extract", 1.0)
+
+    if stats:
+        print(f"Closed {stats['closed']} of {len(point_arrays)} contours, {len(point_arrays.coords)} points")
+
+    print("Stage cache hits:", ", ".join(f"{stage} {counts['hits']}/{counts['hits'] + counts['misses']}"
+                                         for stage, counts in STAGE_CACHE.stats().items()))
+    return point_arrays.copy()
+
+
+def odd(value, minimum=1):
+    """The odd integer closest to value, at least minimum."""
+    return max(int(value // 2) * 2 + 1, minimum)
+
+
+def preview_parameters(shape, blur, blockSize, max_size=PREVIEW_MAX_SIZE):
+    """
+    Scale factor of the preview of an image with the given shape, and the
+    blur and threshold block size that have the same effect at that scale.
+    C is an intensity offset and does not depend on the scale.
+    """
+    factor = min(1.0, max_size / max(shape))
+    return factor, odd(blur * factor), odd(blockSize * factor, minimum=3)
+
+
+def process_preview(image_path, blur, blockSize, C, backend="skimage", max_size=PREVIEW_MAX_SIZE, progress=None):
+    """
+    Rough contours of an image for tuning the preprocessing. The image is
+    downscaled to at most ``max_size`` pixels on its longer side and
+    processed with parameters scaled to match. The contours are scaled back
+    to the coordinates of the full-resolution image, contours too small for
+    the preview resolution are missing. Returns an empty ContourSet if no
+    contour is found.
+    """
+    digest = image_hash(image_path)
+    image_grayscale = STAGE_CACHE.get("load", (digest,), lambda: load_grayscale(image_path))
+    if progress:
+        progress("load", 1.0)
+    factor, blur, blockSize = preview_parameters(image_grayscale.shape, blur, blockSize, max_size)
+    image_small = STAGE_CACHE.get("preview", (digest, max_size),
+                                  lambda: cv2.resize(image_grayscale, None, fx=factor, fy=factor,
+                                                     interpolation=cv2.INTER_AREA))
+    image_edges = threshold(cv2.medianBlur(image_small, blur), blockSize, C)
+    if progress:
+        progress("threshold", 1.0)
+    try:
+        contours = extract_contours(image_edges, backend)
+    except ValueError:  # No contour left after filtering
+        contours = ContourSet.from_list([])
+    if progress:
+        progress("extract", 1.0)
+    # Scale with the actual size of the downscaled image, which cv2.resize rounds
+    return contours.with_coords(contours.coords * (image_grayscale.shape[1] / image_small.shape[1]))
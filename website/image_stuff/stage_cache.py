@@ -0,0 +1,90 @@
+"""
+A bounded in-memory cache for the intermediate results of the image
+processing pipeline.
+
+Every stage result is stored under the stage name and a key made of the
+image hash and the parameters that affect that stage, so changing a late
+parameter only re-runs the stages after it. The least recently used results
+are dropped once the cache holds more than its memory budget.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from website.contour_set import ContourSet
+
+
+def result_size(value) -> int:
+    """Approximate memory size of a stage result in bytes."""
+    if isinstance(value, (np.ndarray, ContourSet)):
+        return value.nbytes
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(result_size(v) for v in value)
+    return 64
+
+
+class StageCache:
+    """
+    LRU cache of stage results with a memory budget in bytes.
+
+    Results are shared between callers and must not be modified.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def get(self, stage: str, key: tuple, compute=None):
+        """
+        Return the cached result of ``stage`` for ``key``, computing it with
+        ``compute()`` if missing. Without ``compute`` a miss returns None.
+        """
+        with self._lock:
+            if (stage, key) in self._entries:
+                self._entries.move_to_end((stage, key))
+                self.hits[stage] = self.hits.get(stage, 0) + 1
+                return self._entries[(stage, key)][0]
+            self.misses[stage] = self.misses.get(stage, 0) + 1
+
+        if compute is None:
+            return None
+        value = compute()
+        self.put(stage, key, value)
+        return value
+
+    def put(self, stage: str, key: tuple, value) -> None:
+        size = result_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if (stage, key) in self._entries:
+                self._size -= self._entries.pop((stage, key))[1]
+            self._entries[(stage, key)] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self._size -= dropped
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits.clear()
+            self.misses.clear()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def stats(self) -> dict:
+        """Hits and misses per stage."""
+        return {stage: {"hits": self.hits.get(stage, 0), "misses": self.misses.get(stage, 0)}
+                for stage in dict.fromkeys([*self.misses, *self.hits])}
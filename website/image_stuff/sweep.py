@@ -0,0 +1,168 @@
+"""
+Parameter sweep over the preprocessing options of one image.
+
+Every combination of blur intensity, threshold block size and threshold C
+is processed in a pool of worker processes. The image is decoded and
+converted to grayscale once and handed to every worker once, and each
+worker caches its blurred images, so only the steps that depend on a
+parameter are repeated. For every setting the sweep reports the contour
+count, the stroke length and the cycle time the motion simulator
+estimates for the program of the drawing area, with the contours smoothed
+and resampled like the converter does, plus a PNG thumbnail of the
+contours.
+Given a target stroke length, it picks the setting whose drawing comes
+closest to it without exceeding it.
+"""
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from website.contour_set import ContourSet
+from website.image_stuff.image_conversion import STAGE_CACHE, image_hash, load_grayscale, threshold, extract_contours
+from website.kuka import converter, simulator
+
+THUMBNAIL_SIZE = 160  # Size of the longer side of the thumbnails in pixels
+
+_image = {}  # The grayscale image of the sweep in a worker process
+
+
+def _init_worker(image_grayscale, digest):
+    _image["grayscale"] = image_grayscale
+    _image["digest"] = digest
+
+
+def settings_grid(blurs, block_sizes, cs):
+    """All combinations of the parameters, checked like the web interface does."""
+    for blur in blurs:
+        if blur < 1 or blur % 2 == 0:
+            raise ValueError(f"Blur intensity must be odd and positive, not {blur}")
+    for block_size in block_sizes:
+        if block_size < 3 or block_size % 2 == 0:
+            raise ValueError(f"Threshold block size must be odd and at least 3, not {block_size}")
+    return [{"blur_intensity": blur, "threshold_block_size": block_size, "threshold_C": c}
+            for blur, block_size, c in itertools.product(blurs, block_sizes, cs)]
+
+
+def stroke_metrics(contours, scale, border, mode="preserve", step=converter.POINT_DISTANCE,
+                   tolerance=converter.TOLERANCE):
+    """
+    Contour count, stroke length, pen-up travel and estimated drawing time in
+    the drawing area. The time is estimated for the points the program is
+    drawn with, resampled every step mm or within tolerance.
+    """
+    if len(contours) == 0:
+        return {"contours": 0, "points": 0, "stroke_length": 0.0, "travel_length": 0.0, "draw_time": 0.0}
+    scaled = converter.scale_contours(contours, scale, border, mode)
+    segments = np.hypot(*np.diff(scaled.coords, axis=0).T)
+    # Segments spanning two contours are pen-up moves
+    is_travel = np.zeros(len(segments), dtype=bool)
+    is_travel[scaled.offsets[1:-1] - 1] = True
+    home = np.array([converter.HOME_X, converter.HOME_Y])
+    stroke_length = np.sum(segments[~is_travel])
+    travel_length = (np.sum(segments[is_travel]) + np.hypot(*(scaled.coords[0] - home))
+                     + np.hypot(*(scaled.coords[-1] - home)))
+    return {
+        "contours": len(contours),
+        "points": len(contours.coords),
+        "stroke_length": float(stroke_length),
+        "travel_length": float(travel_length),
+        "draw_time": simulator.estimate_contours(list(converter.iter_smoothed(scaled, step, tolerance)))["total"],
+    }
+
+
+def thumbnail(contours, shape, size=THUMBNAIL_SIZE):
+    """PNG image of the contours, fitted into size x size pixels."""
+    height, width = shape
+    factor = size / max(height, width)
+    canvas = np.full((max(round(height * factor), 1), max(round(width * factor), 1)), 255, dtype=np.uint8)
+    if len(contours):
+        # The contours are flipped upside down, flip them back for the image.
+        coords = contours.coords.copy()
+        coords[:, 1] = np.min(coords) + np.max(coords) - coords[:, 1]
+        points = np.round(coords * factor).astype(np.int32)
+        cv2.polylines(canvas, [points[start:end] for start, end in zip(contours.offsets[:-1], contours.offsets[1:])],
+                      isClosed=False, color=0, thickness=1, lineType=cv2.LINE_AA)
+    return cv2.imencode(".png", canvas)[1].tobytes()
+
+
+def evaluate(setting, backend, scale, border, mode, step, tolerance, thumbnail_size):
+    """Process the worker's image with one setting and return its metrics."""
+    image_grayscale, digest = _image["grayscale"], _image["digest"]
+    blur = setting["blur_intensity"]
+    image_blur = STAGE_CACHE.get("blur", (digest, blur), lambda: cv2.medianBlur(image_grayscale, blur))
+    image_edges = threshold(image_blur, setting["threshold_block_size"], setting["threshold_C"])
+    try:
+        contours = extract_contours(image_edges, backend)
+    except ValueError:  # No contour left after filtering
+        contours = ContourSet.from_list([])
+    result = dict(setting, **stroke_metrics(contours, scale, border, mode, step, tolerance))
+    if thumbnail_size:
+        result["thumbnail"] = thumbnail(contours, image_grayscale.shape, thumbnail_size)
+    return result
+
+
+def best_setting(results, target_length):
+    """The result with the longest stroke length within the target, or the shortest one if none is."""
+    within = [r for r in results if r["contours"] and r["stroke_length"] <= target_length]
+    if within:
+        return max(within, key=lambda r: r["stroke_length"])
+    candidates = [r for r in results if r["contours"]]
+    return min(candidates, key=lambda r: r["stroke_length"]) if candidates else None
+
+
+def sweep(image_path, blurs, block_sizes, cs, backend="skimage", scale=(210, 297), border=20, mode="preserve",
+          step=converter.POINT_DISTANCE, tolerance=converter.TOLERANCE, workers=None, thumbnail_size=THUMBNAIL_SIZE,
+          target_length=None, progress=None):
+    """
+    Evaluate all combinations of the parameters for one image.
+
+    Parameters:
+      image_path (str): The image.
+      blurs, block_sizes, cs (list of int): The values to try for the blur
+                                            intensity, threshold block size
+                                            and threshold C.
+      backend (str): The contour backend.
+      scale, border, mode: The drawing area the metrics are computed for,
+                           see converter.iter_krl_script.
+      step, tolerance: The resampling the drawing time is estimated with,
+                       see converter.iter_krl_script.
+      workers (int): Number of worker processes. None or 1 evaluates the
+                     settings in this process.
+      thumbnail_size (int): Size of the thumbnails, 0 for none.
+      target_length (float): If set, the stroke budget in mm the best setting is picked for.
+      progress (callable): Called as progress("sweep", fraction) after every setting.
+
+    Returns:
+      tuple: The results in the order of the grid, and the best result or None.
+    """
+    settings = settings_grid(blurs, block_sizes, cs)
+    digest = image_hash(image_path)
+    image_grayscale = STAGE_CACHE.get("load", (digest,), lambda: load_grayscale(image_path))
+    scale, border = np.asarray(scale, dtype=float), np.array([border, border], dtype=float)
+    args = (backend, scale, border, mode, step, tolerance, thumbnail_size)
+
+    results = []
+    if not workers or workers <= 1:
+        _init_worker(image_grayscale, digest)
+        for setting in settings:
+            results.append(evaluate(setting, *args))
+            if progress:
+                progress("sweep", len(results) / len(settings))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(image_grayscale, digest)) as executor:
+            futures = [executor.submit(evaluate, setting, *args) for setting in settings]
+            try:
+                for future in futures:
+                    results.append(future.result())
+                    if progress:
+                        progress("sweep", len(results) / len(settings))
+            except BaseException:
+                executor.shutdown(cancel_futures=True)
+                raise
+
+    best = best_setting(results, target_length) if target_length is not None else None
+    return results, best
@@ -0,0 +1,196 @@
+"""
+Tiled, memory-bounded contour extraction for very large images.
+
+process_image holds a dozen full-frame buffers at once: the RGBA image, its
+padded and alpha-composited copies, the grayscale, blurred and thresholded
+images and a float64 copy for marching squares. The tiled pipeline keeps
+only the decoded image, the grayscale image and the thresholded image in
+full, one byte per pixel each. Everything else works on tiles:
+
+- The grayscale image is composited band by band.
+- Blur and threshold run on tiles with a halo of blur // 2 + blockSize // 2
+  pixels, so the thresholded image equals the one of the whole image.
+- Marching squares runs on tiles that share their boundary rows and
+  columns. Contours crossing a seam end on it in both tiles at the same
+  points, and are stitched back together by their end points.
+
+Tiles are processed one after another or in a worker pool. The contours
+describe the same curves as the ones of the whole image, but closed
+contours crossing seams may start at a different point, so smoothing and
+closing can give slightly different points near the start.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+from skimage import measure
+
+from website.image_stuff.image_conversion import image_hash, threshold, postprocess_contours, CONTOUR_BACKENDS, \
+    STAGE_CACHE
+
+TILE_SIZE = 1024  # Side of the tiles in pixels
+BAND_ROWS = 128  # Rows of the image converted to grayscale at a time
+BORDER = 20  # White border added around the image, as load_grayscale does
+WORKERS = None  # Number of workers for the tiles (None or 1 processes them in this thread)
+POOL = "thread"  # "process" or "thread" pool for parallel tiles
+
+
+def load_grayscale_tiled(image_path, band_rows=BAND_ROWS):
+    """
+    load_grayscale converting bands of ``band_rows`` rows at a time, so only
+    the decoded image and the grayscale result are held in full.
+    """
+    image = Image.open(image_path)
+    width, height = image.size
+    image_grayscale = np.full((height + 2 * BORDER, width + 2 * BORDER), 255, dtype=np.uint8)
+    for top in range(0, height, band_rows):
+        band = image.crop((0, top, width, min(top + band_rows, height))).convert("RGBA")
+        white_bg = Image.new("RGBA", band.size, (255, 255, 255, 255))
+        band_np = np.array(Image.alpha_composite(white_bg, band))
+        image_grayscale[BORDER + top:BORDER + top + band.size[1], BORDER:BORDER + width] = \
+            cv2.cvtColor(band_np, cv2.COLOR_BGR2GRAY)
+    return image_grayscale
+
+
+def tiles(shape, tile_size=TILE_SIZE, shared=False):
+    """
+    (top, bottom, left, right) bounds of the tiles covering an image. With
+    ``shared``, neighbouring tiles share their boundary row or column.
+    """
+    height, width = shape
+    overlap = 1 if shared else 0
+    step = max(tile_size - overlap, 1)
+    rows = [(top, min(top + tile_size, height)) for top in range(0, max(height - overlap, 1), step)]
+    cols = [(left, min(left + tile_size, width)) for left in range(0, max(width - overlap, 1), step)]
+    return [(top, bottom, left, right) for top, bottom in rows for left, right in cols]
+
+
+def _threshold_tile(image_tile, halo, blur, blockSize, C):
+    """Blur and threshold a tile with its halo and return the tile without the halo."""
+    top, bottom, left, right = halo
+    edges = threshold(cv2.medianBlur(image_tile, blur), blockSize, C)
+    return edges[top:edges.shape[0] - bottom, left:edges.shape[1] - right]
+
+
+def _contour_tile(edges_tile, top, left, level):
+    """Marching squares contours of a tile as (x, y) point arrays in image coordinates."""
+    contours = measure.find_contours(edges_tile.astype(float), level=level)
+    return [np.fliplr(contour) + (left, top) for contour in contours]
+
+
+def _map(fn, args, workers, pool):
+    """Yield fn(*a) for every tuple of args in order, computed here or in a worker pool."""
+    if not workers or workers <= 1 or len(args) <= 1:
+        for a in args:
+            yield fn(*a)
+        return
+    executor_class = {"process": ProcessPoolExecutor, "thread": ThreadPoolExecutor}[pool]
+    with executor_class(max_workers=workers) as executor:
+        yield from executor.map(fn, *zip(*args))
+
+
+def threshold_tiled(image_grayscale, blur, blockSize, C, tile_size=TILE_SIZE, workers=WORKERS, pool=POOL):
+    """threshold(cv2.medianBlur(image_grayscale, blur), blockSize, C), computed tile by tile."""
+    height, width = image_grayscale.shape
+    margin = blur // 2 + blockSize // 2
+    bounds = tiles(image_grayscale.shape, tile_size)
+    args = []
+    for top, bottom, left, right in bounds:
+        outer = (max(top - margin, 0), min(bottom + margin, height), max(left - margin, 0), min(right + margin, width))
+        halo = (top - outer[0], outer[1] - bottom, left - outer[2], outer[3] - right)
+        args.append((image_grayscale[outer[0]:outer[1], outer[2]:outer[3]], halo, blur, blockSize, C))
+
+    image_edges = np.empty_like(image_grayscale)
+    for (top, bottom, left, right), edges in zip(bounds, _map(_threshold_tile, args, workers, pool)):
+        image_edges[top:bottom, left:right] = edges
+    return image_edges
+
+
+def stitch(pieces, decimals=6):
+    """
+    Join contour pieces whose last point is the first point of another one.
+    Pieces not continued by another piece are kept as they are.
+    """
+    def key(point):
+        return tuple(np.round(point, decimals))
+
+    starts = {}
+    for i, piece in enumerate(pieces):
+        starts.setdefault(key(piece[0]), []).append(i)
+    ends = {key(piece[-1]) for piece in pieces}
+
+    used = np.zeros(len(pieces), dtype=bool)
+    contours = []
+
+    def follow(i):
+        chain = [pieces[i]]
+        used[i] = True
+        first = key(pieces[i][0])
+        while (end := key(chain[-1][-1])) != first:
+            following = [j for j in starts.get(end, []) if not used[j]]
+            if not following:
+                break
+            used[following[0]] = True
+            chain.append(pieces[following[0]][1:])
+        return np.concatenate(chain)
+
+    # Open contours first, starting at pieces no other piece ends at
+    for i, piece in enumerate(pieces):
+        if not used[i] and key(piece[0]) not in ends:
+            contours.append(follow(i))
+    for i in range(len(pieces)):
+        if not used[i]:
+            contours.append(follow(i))
+    return contours
+
+
+def find_contours_tiled(image_edges, level=0.9, tile_size=TILE_SIZE, workers=WORKERS, pool=POOL):
+    """
+    Marching squares contours of the thresholded image, found on tiles
+    sharing their boundary rows and columns and stitched at the seams.
+    """
+    bounds = tiles(image_edges.shape, tile_size, shared=True)
+    args = [(image_edges[top:bottom, left:right], top, left, level) for top, bottom, left, right in bounds]
+    interior, pieces = [], []
+    for contours in _map(_contour_tile, args, workers, pool):
+        for contour in contours:
+            closed = len(contour) > 1 and np.array_equal(contour[0], contour[-1])
+            (interior if closed else pieces).append(contour)
+    return interior + stitch(pieces)
+
+
+def process_image_tiled(image_path, blur, blockSize, C, backend="skimage", tile_size=TILE_SIZE, workers=WORKERS,
+                        pool=POOL, progress=None):
+    """
+    Contours of an image as a ContourSet, like process_image, with bounded
+    memory. The marching squares backend runs on tiles, the OpenCV backend
+    follows the borders of the whole thresholded image, which only needs a
+    byte per pixel.
+    """
+    digest = image_hash(image_path)
+    key = (digest, blur, blockSize, C, backend, "tiled", tile_size)
+    if (contours := STAGE_CACHE.get("contours", key)) is None:
+        image_grayscale = load_grayscale_tiled(image_path)
+        if progress:
+            progress("load", 1.0)
+        image_edges = threshold_tiled(image_grayscale, blur, blockSize, C, tile_size, workers, pool)
+        del image_grayscale
+        if progress:
+            progress("threshold", 1.0)
+        if backend == "skimage":
+            raw_contours = find_contours_tiled(image_edges, 0.9, tile_size, workers, pool)
+        else:
+            raw_contours = CONTOUR_BACKENDS[backend](image_edges, level=0.9)
+        del image_edges
+        stats = {}
+        contours = postprocess_contours(raw_contours, stats)
+        print(f"Closed {stats['closed']} of {len(contours)} contours, {len(contours.coords)} points")
+        STAGE_CACHE.put("contours", key, contours)
+    elif progress:
+        progress("load", 1.0)
+        progress("threshold", 1.0)
+    if progress:
+        progress("extract", 1.0)
+    return contours.copy()
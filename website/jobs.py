@@ -0,0 +1,125 @@
+"""
+Background jobs for long running conversions.
+
+Jobs run in a local thread pool of the web server process, so no external
+broker is needed. Every job reports the progress of its stages and can be
+cancelled: the job function receives the job and calls ``job.report`` from
+time to time, which raises JobCancelled once the job has been cancelled.
+Results that are ready before the job finishes are published with
+``job.publish``, so clients can show them early.
+
+Unlike the result cache and the artifact store, jobs only exist in the
+memory of the process that started them. The web server must therefore
+run as a single process, or route all requests of a session to the same
+process (sticky sessions). Otherwise the status, cancellation and results
+of a job are unknown to the other processes.
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+STAGES = ("load", "threshold", "extract", "smooth", "emit")
+JOB_TTL = 3600  # Seconds a finished job is kept for clients to pick up its results
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+
+    def __init__(self, stages=STAGES):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.progress = dict.fromkeys(stages, 0.0)
+        self.partial = {}
+        self.result = None
+        self.error = None
+        self.finished_at = None
+        self._cancelled = threading.Event()
+
+    def report(self, stage: str, fraction: float = 1.0) -> None:
+        """Record the progress of a stage, raises JobCancelled if the job was cancelled."""
+        if self._cancelled.is_set():
+            raise JobCancelled(self.id)
+        self.progress[stage] = min(max(fraction, 0.0), 1.0)
+
+    def publish(self, name: str, value) -> None:
+        """Make a partial result available before the job finishes."""
+        self.partial[name] = value
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        if self.status == "queued":
+            self._finish("cancelled")
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def run(self, fn, *args, **kwargs) -> None:
+        if self.cancelled:
+            return
+        self.status = "running"
+        try:
+            self.result = fn(self, *args, **kwargs)
+            self._finish("done")
+        except JobCancelled:
+            self._finish("cancelled")
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            print(f"Job {self.id} failed: {self.error}")
+            self._finish("failed")
+
+    def _finish(self, status: str) -> None:
+        self.status = status
+        self.finished_at = time.time()
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "status": self.status, "progress": self.progress, "partial": list(self.partial),
+                "error": self.error}
+
+
+class JobQueue:
+    """
+    Runs jobs in a pool of worker threads. With no workers, jobs run
+    synchronously when they are submitted.
+    """
+
+    def __init__(self, workers: int = 2):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job") if workers else None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, stages=STAGES, **kwargs) -> Job:
+        """Run ``fn(job, *args, **kwargs)`` as a new job reporting the given stages."""
+        job = Job(stages)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+        if self._executor is None:
+            job.run(fn, *args, **kwargs)
+        else:
+            self._executor.submit(job.run, fn, *args, **kwargs)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> None:
+        if job := self.get(job_id):
+            job.cancel()
+
+    def _expire(self) -> None:
+        deadline = time.time() - JOB_TTL
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < deadline]:
+            del self._jobs[job_id]
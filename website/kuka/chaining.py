@@ -0,0 +1,114 @@
+"""
+Chaining of contours with touching endpoints into single strokes.
+
+Every contour is drawn as its own block: approach, pen down, wait, draw,
+pen up. Open fragments often end right where another fragment begins, for
+example the pieces left by dedupe.remove_overlaps or by a contour finder
+that stops at junctions. This module joins contours whose endpoints lie
+within a small gap into chains that are drawn in one pen-down stroke:
+
+  - all contour endpoints are put in a KD-tree, which yields the candidate
+    joins within the gap without comparing every pair of contours,
+  - the joins are taken greedily from the shortest gap up, every endpoint
+    joins at most one other endpoint and a union-find rejects joins that
+    would close a chain into a ring,
+  - every chain is walked from one of its free ends, reversing the contours
+    entered at their last point.
+
+The drawn gap between two joined contours is at most the configured gap.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# ===========================================================
+# Configuration Parameters (adjust as needed)
+# ===========================================================
+CHAIN_GAP = 0.5  # Max distance in mm between the endpoints of two contours drawn as one stroke
+
+
+# ===========================================================
+# Helper Functions
+# ===========================================================
+def _find(parent, i):
+    """Root of i in a union-find forest, halving the path on the way."""
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def _joins(endpoints, gap):
+    """
+    Endpoint links of the greedy chaining. Endpoint 2 * c is the first and
+    2 * c + 1 the last point of contour c.
+
+    Returns:
+      np.array: For every endpoint the endpoint it is joined to, or -1.
+    """
+    link = np.full(len(endpoints), -1)
+    pairs = cKDTree(endpoints).query_pairs(gap, output_type="ndarray")
+    pairs = pairs[pairs[:, 0] // 2 != pairs[:, 1] // 2]
+    if len(pairs) == 0:
+        return link
+    distance = np.hypot(*(endpoints[pairs[:, 0]] - endpoints[pairs[:, 1]]).T)
+    parent = list(range(len(endpoints) // 2))
+    for a, b in pairs[np.argsort(distance, kind="stable")]:
+        if link[a] != -1 or link[b] != -1:
+            continue
+        root_a, root_b = _find(parent, a // 2), _find(parent, b // 2)
+        if root_a == root_b:
+            continue
+        parent[root_a] = root_b
+        link[a], link[b] = b, a
+    return link
+
+
+# ===========================================================
+# Public Interface
+# ===========================================================
+def chain_contours(contours, gap=CHAIN_GAP):
+    """
+    Join contours whose endpoints are at most ``gap`` apart into chains,
+    reversing contours where needed.
+
+    Parameters:
+      contours (list of np.array): Each element is an (N,2) array of points
+                                   in the robot coordinate system.
+      gap (float): Max distance in mm between two joined endpoints.
+
+    Returns:
+      tuple: The chains, ordered by their lowest contour, and a dict with the
+             number of contours before and of chains after the chaining.
+    """
+    contours = [np.asarray(c, dtype=float) for c in contours if len(c) > 0]
+    stats = {"contours": len(contours), "chains": len(contours)}
+    if len(contours) < 2:
+        return contours, stats
+
+    endpoints = np.array([point for c in contours for point in (c[0], c[-1])])
+    link = _joins(endpoints, gap)
+
+    chains = []
+    visited = np.zeros(len(contours), dtype=bool)
+    for first in range(len(contours)):
+        if visited[first]:
+            continue
+        # Walk back to the free end of the chain, so its first contour keeps its direction
+        start = 2 * first
+        while link[start] != -1:
+            start = link[start] ^ 1
+        parts = []
+        endpoint = start
+        while endpoint != -1:
+            c = endpoint // 2
+            visited[c] = True
+            part = contours[c] if endpoint % 2 == 0 else contours[c][::-1]
+            if parts and np.array_equal(parts[-1][-1], part[0]):
+                part = part[1:]
+            parts.append(part)
+            endpoint = link[endpoint ^ 1]
+        chains.append(np.vstack(parts))
+
+    stats["chains"] = len(chains)
+    return chains, stats
@@ -7,9 +7,19 @@ ensuring smooth drawn curves. The generated KRL file uses standard KUKA
 guidelines with proper header lines and instructions.
 """
 
+import hashlib
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import numpy as np
 from scipy.interpolate import splprep, splev
 
+from website.contour_set import ContourSet
+from website.image_stuff.stage_cache import StageCache
+from website.kuka import path_optimizer, dedupe, chaining
+from website.kuka.geometry import simplify_polyline
+
 # ===========================================================
 # Configuration Parameters (adjust as needed)
 # ===========================================================
@@ -18,17 +28,101 @@ TRAVEL_Z = 10.0  # Z height when pencil is up (travel mode)
 DRAW_Z = 0.0  # Z height when pencil is down (drawing mode)
 HOME_X = 0.0  # Home X coordinate
 HOME_Y = 0.0  # Home Y coordinate
+PEN_WAIT = 0.1  # Seconds waited after lowering the pencil
 
 
 # Spline smoothing parameters
 SMOOTHING_FACTOR = 0.5  # Increase to smooth more (0 forces interpolation through all points)
 POINT_DISTANCE = 2  # Point Distance in mm
+TOLERANCE = None  # Max deviation in mm for adaptive resampling (None resamples at POINT_DISTANCE)
+MAX_DENSIFICATION = 100  # The spline is sampled at most every distance / MAX_DENSIFICATION for adaptive resampling
+
+# Drawing moves: "lin" draws a contour with LIN ... C_DIS moves, "spline" with one SPLINE block of SPL points
+MOTION = "lin"
+MOTION_MODES = ("lin", "spline")
+SPLINE_TOLERANCE = 0.1  # Max deviation in mm of the SPL points from the smoothed contour, if no tolerance is set
+
+# Programs: the whole drawing, and when split into parts, the entry point resuming from a part and the parts
+PROGRAM_NAME = "DRAW_PICTURE"
+RESUME_NAME = "DRAW_RESUME"
+PART_NAME = "DRAW_PART_{:03d}"
+PROGRAM_FOOTER = "PTP p_home\nEND\n"
+CONTOUR_HEADER_PATTERN = re.compile(r"^; ----- Contour (\d+) -----$", re.MULTILINE)
+HOME_DECLARATION_PATTERN = re.compile(r"^[ \t]*(?:DECL[ \t]+)?POS[ \t]+p_home\b", re.MULTILINE | re.IGNORECASE)
+# First statement after the declarations, any line that is not blank, a comment or a declaration
+STATEMENT_PATTERN = re.compile(r"^[ \t]*(?!;|$|(?:DECL|INT|REAL|BOOL|CHAR|POS|E6POS|FRAME|AXIS|E6AXIS)\b)",
+                               re.MULTILINE | re.IGNORECASE)
+
+# Parallel smoothing parameters
+WORKERS = None  # Number of worker processes for smoothing (None or 1 smooths serially)
+POOL = "process"  # "process" or "thread" pool for parallel smoothing
+CHUNK_POINTS = 5000  # Min number of points smoothed per task, small contours are grouped
+
+# Cache of the KRL blocks of single contours, reused when only some contours change
+BLOCK_CACHE_BUDGET = 64 * 1024 * 1024  # Memory budget in bytes
+BLOCK_CACHE = StageCache(BLOCK_CACHE_BUDGET)
 
 
 # ===========================================================
 # Spline Interpolation Function
 # ===========================================================
-def smooth_contour(contour, smoothing=SMOOTHING_FACTOR, distance=POINT_DISTANCE):
+def num_resampled_points(contour, distance=POINT_DISTANCE):
+    """
+    Number of points a contour is resampled to at a fixed point distance.
+
+    Parameters:
+      contour (np.array): An (N, 2) array of (x, y) points.
+      distance (float): Distance between the resampled points.
+
+    Returns:
+      int: The number of resampled points.
+    """
+    mean = np.mean(np.sqrt(np.square(contour[:-1, 0] - contour[1:, 0]) + np.square(contour[:-1, 1] - contour[1:, 1])))
+    return max(int((len(contour) * mean) / distance), 1)
+
+
+def spline_points(points, u, tolerance):
+    """
+    Control points of a spline that follows a densely sampled curve.
+
+    Starts with the polyline simplification of the curve and refines it like
+    simplify_polyline: an interpolating cubic spline is fitted through the
+    kept points, and every span in which the spline deviates more than
+    tolerance from the samples is split at its farthest sample. A spline
+    through points deviates far less from a smooth curve than the polyline
+    through them, so the spline needs fewer points for the same tolerance.
+
+    Parameters:
+      points (np.array): An (N, 2) array of samples of the curve.
+      u (np.array): The strictly increasing curve parameter of the samples.
+      tolerance (float): Maximum distance of a sample from the spline.
+
+    Returns:
+      np.array: The sorted indices of the control points.
+    """
+    n = len(points)
+    idx = simplify_polyline(points, 4 * tolerance)
+    keep = np.zeros(n, dtype=bool)
+    keep[idx] = True
+    while True:
+        idx = np.flatnonzero(keep)
+        if len(idx) < 3:
+            return idx
+        tck, _ = splprep(points[idx].T, u=u[idx], s=0, k=min(3, len(idx) - 1))
+        dist = np.hypot(*(np.column_stack(splev(u, tck)) - points).T)
+        dist[keep] = 0
+
+        # Split every span at its farthest sample if that is out of tolerance.
+        seg = np.minimum(np.searchsorted(idx, np.arange(n), side="right") - 1, len(idx) - 2)
+        seg_max = np.maximum.reduceat(dist, idx[:-1])
+        split = (dist > tolerance) & (dist == seg_max[seg])
+        if not np.any(split):
+            return idx
+        _, first = np.unique(seg[split], return_index=True)
+        keep[np.flatnonzero(split)[first]] = True
+
+
+def smooth_contour(contour, smoothing=SMOOTHING_FACTOR, distance=POINT_DISTANCE, tolerance=TOLERANCE, spline=False):
     """
     Smooth a 2D contour using parametric spline interpolation.
 
@@ -36,6 +130,15 @@ def smooth_contour(contour, smoothing=SMOOTHING_FACTOR, distance=POINT_DISTANCE)
       contour (np.array): An (N, 2) array of (x, y) points.
       smoothing (float): Smoothing factor for splprep. Use 0 to force interpolation
                          through every point.
+      distance (float): Distance between the resampled points.
+      tolerance (float): If set, the spline is resampled adaptively instead:
+                         straight parts get few points, tight curves many, and
+                         no part of the spline deviates more than tolerance
+                         from the resampled polyline. The spline is checked
+                         every quarter tolerance along the contour, so this
+                         also holds for contours shorter than distance.
+      spline (bool): Resample for a spline through the points instead of a
+                     polyline, see spline_points. Requires a tolerance.
 
     Returns:
       np.array: An (num_points, 2) array of smoothed (x, y) points.
@@ -47,143 +150,492 @@ def smooth_contour(contour, smoothing=SMOOTHING_FACTOR, distance=POINT_DISTANCE)
     # Compute cumulative arc length to parameterize the contour.
     distances = np.sqrt(np.diff(x) ** 2 + np.diff(y) ** 2)
     t = np.concatenate(([0], np.cumsum(distances)))
-    if t[-1] == 0:
+    length = t[-1]
+    if length == 0:
         return contour  # If degenerate, return original
-    t /= t[-1]  # Normalize t to [0, 1]
+    t /= length  # Normalize t to [0, 1]
 
     # Fit a parametric spline to the points.
     tck, _ = splprep([x, y], s=smoothing, u=t)
 
     # Generate new, uniformly spaced parameter values.
-    mean = np.mean(np.sqrt(np.square(contour[:-1, 0] - contour[1:, 0]) + np.square(contour[:-1, 1] - contour[1:, 1])))
-    num_points = max(int((len(contour) * mean) / distance), 1)
+    num_points = num_resampled_points(contour, distance)
+    if tolerance:
+        # Sample the spline every quarter tolerance along the contour, however
+        # short it is, so the chords stay well within the tolerance, then drop
+        # every point the tolerance allows. The samples are never closer than
+        # distance / MAX_DENSIFICATION, their chords deviate far less than
+        # that from the spline.
+        spacing = max(tolerance / 4, distance / MAX_DENSIFICATION)
+        num_points = max(int(np.ceil(length / spacing)) + 1, num_points)
     u_fine = np.linspace(0, 1, num_points)
 
     # Evaluate the spline to obtain smoothed coordinates.
     x_smooth, y_smooth = splev(u_fine, tck)
     smoothed_contour = np.vstack((x_smooth, y_smooth)).T
+    if tolerance and spline:
+        smoothed_contour = smoothed_contour[spline_points(smoothed_contour, u_fine, tolerance)]
+    elif tolerance:
+        smoothed_contour = smoothed_contour[simplify_polyline(smoothed_contour, tolerance)]
     return smoothed_contour
 
 
+def _smooth_chunk(chunk, distance, tolerance, spline=False):
+    return [smooth_contour(contour, distance=distance, tolerance=tolerance, spline=spline) for contour in chunk]
+
+
+def _chunks(contours, chunk_points):
+    """Group consecutive contours into chunks of at least chunk_points points."""
+    chunk = []
+    points = 0
+    for contour in contours:
+        chunk.append(contour)
+        points += len(contour)
+        if points >= chunk_points:
+            yield chunk
+            chunk = []
+            points = 0
+    if chunk:
+        yield chunk
+
+
+def iter_smoothed(contours, distance=POINT_DISTANCE, tolerance=TOLERANCE, workers=WORKERS, pool=POOL,
+                  chunk_points=CHUNK_POINTS, spline=False):
+    """
+    Smooth contours one after another or in a worker pool.
+
+    The results are yielded in the order of the contours in both modes, so
+    the output does not depend on the number of workers.
+
+    Parameters:
+      contours (iterable of np.array): (N, 2) arrays of (x, y) points.
+      distance (float): Distance between the resampled points.
+      tolerance (float): Max deviation for adaptive resampling, see smooth_contour.
+      workers (int): Number of workers. None or 1 smooths in this thread.
+      pool (str): "process" for a process pool, "thread" for a thread pool.
+      chunk_points (int): Min number of points per task. Small contours
+                          are smoothed together to amortize the task overhead.
+      spline (bool): Resample for SPL points, see smooth_contour.
+
+    Yields:
+      np.array: The smoothed contours.
+    """
+    chunks = [[np.asarray(c) for c in chunk] for chunk in _chunks(contours, chunk_points)]
+    if not workers or workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield from _smooth_chunk(chunk, distance, tolerance, spline)
+        return
+
+    executor_class = {"process": ProcessPoolExecutor, "thread": ThreadPoolExecutor}[pool]
+    with executor_class(max_workers=workers) as executor:
+        for smoothed in executor.map(_smooth_chunk, chunks, [distance] * len(chunks), [tolerance] * len(chunks),
+                                     [spline] * len(chunks)):
+            yield from smoothed
+
+
 # ===========================================================
 # KRL Generation Function
 # ===========================================================
-def generate_krl_script(contours, save=True, filename="draw.src", scale=None, border=None, mode="preserve", base_id=3,
-                        tool_id=3, step=2):
+def format_contour(smooth_pts, number, motion=MOTION):
     """
-    Generates a KUKA KRL source file that instructs a 6-axis robot to draw
-    the lines defined by the given (smoothed) contours.
+    Format one smoothed contour as a block of KRL lines.
+
+    The coordinates of the whole contour are formatted in one operation
+    instead of one f-string per point.
+
+    Parameters:
+      smooth_pts (np.array): An (N,2) array of points in robot coordinates.
+      number (int): The contour number used in the block comment.
+      motion (str): "lin" or "spline", see format_contour_moves.
+
+    Returns:
+      str: The KRL block, every line terminated by a newline.
+    """
+    return format_contour_header(number) + format_contour_moves(smooth_pts, motion)
+
+
+def format_contour_header(number):
+    return f"; ----- Contour {number} -----\n"
+
+
+def format_contour_moves(smooth_pts, motion=MOTION):
+    """
+    Format the moves of one smoothed contour, the block without its header.
+    They do not depend on the position of the contour in the program.
+
+    With motion "lin" the contour is drawn with approximated LIN moves, with
+    "spline" as one SPLINE block whose SPL points the controller connects
+    with a smooth curve.
+    """
+    travel_pose = f"Z {TRAVEL_Z:.2f}, A 0, B 0, C 0}}"
+    draw_pose = f"Z {DRAW_Z:.2f}, A 0, B 0, C 0}}"
+    start_x, start_y = smooth_pts[0]
+    last_x, last_y = smooth_pts[-1]
+
+    # Move with pencil up (PTP) to starting point, then lower the pencil using a LIN move.
+    head = (f"PTP {{X {start_x:.2f}, Y {start_y:.2f}, {travel_pose}\n"
+            f"LIN {{X {start_x:.2f}, Y {start_y:.2f}, {draw_pose}\n"
+            f"WAIT SEC {PEN_WAIT:g}\n")
+    # Draw the contour with LIN moves, or with a spline through its points.
+    if motion == "spline":
+        body = ("SPL {X %.2f, Y %.2f, " + draw_pose + "\n") * (len(smooth_pts) - 1)
+        if body:
+            body = "SPLINE\n" + body + "ENDSPLINE\n"
+    else:
+        body = ("LIN {X %.2f, Y %.2f, " + draw_pose + " C_DIS\n") * (len(smooth_pts) - 1)
+    body %= tuple(np.asarray(smooth_pts[1:]).ravel().tolist())
+    # End the contour by lifting the pencil.
+    tail = f"LIN {{X {last_x:.2f}, Y {last_y:.2f}, {travel_pose}\n\n"
+    return head + body + tail
+
+
+def block_key(contour, step, tolerance, motion=MOTION):
+    """
+    Cache key of the KRL block of a contour in robot coordinates.
+
+    The scaled points already reflect scale, border, mode and the bounding
+    box of the drawing, so the block of a contour is reused only while all
+    of them stay the same. Hiding or showing a contour that defines the
+    bounding box rescales the drawing and misses every block: the spacing,
+    tolerance and smoothing factor are in mm, so smoothed points cannot be
+    carried over to another scale.
+    """
+    digest = hashlib.blake2b(np.ascontiguousarray(contour, dtype=float).tobytes(), digest_size=16).hexdigest()
+    return digest, step, tolerance, motion, SMOOTHING_FACTOR, TRAVEL_Z, DRAW_Z
+
+
+def scale_contours(contours, scale, border, mode="preserve"):
+    """
+    Scale contours from image coordinates to the drawing area in one
+    vectorized operation.
+
+    Parameters:
+      contours (ContourSet or list of np.array): The contours to scale.
+      scale (np.array): Size [X, Y] of the drawing area in mm.
+      border (np.array): Border [X, Y] in mm kept free on each side.
+      mode (str): "preserve" keeps the aspect ratio, "scale_paper" stretches
+                  the drawing to the drawing area.
+
+    Returns:
+      ContourSet: The contours in robot coordinates.
+    """
+    # Determine the maximum dimensions across all contours
+    contours = ContourSet.from_list(contours)
+    min_xy = np.min(contours.coords, axis=0)
+    max_xy = np.max(contours.coords, axis=0)
+
+    diff = max_xy - min_xy
+
+    true_scaling = scale - 2 * border
+
+    # scale Points, all contours at once
+    match mode:
+        case "preserve":
+            scale_fac = min(true_scaling)
+
+            contours = contours.with_coords((contours.coords - min_xy) / diff * scale_fac + border)
+
+        case "scale_paper":
+
+            contours = contours.with_coords((contours.coords - min_xy) / diff * true_scaling + border)
+
+    return contours
+
+
+def iter_krl_script(contours, scale=None, border=None, mode="preserve", base_id=3, tool_id=3, step=2, optimize=False,
+                    tolerance=TOLERANCE, overlap_tolerance=None, chain_gap=None, motion=MOTION, workers=WORKERS,
+                    pool=POOL, block_cache=BLOCK_CACHE, progress=None):
+    """
+    Generates a KUKA KRL program that instructs a 6-axis robot to draw
+    the lines defined by the given (smoothed) contours, chunk by chunk.
 
     Each contour is drawn as follows:
       - A PTP move (pencil up) to the contour's start.
       - A LIN move to lower the pencil to DRAW_Z and set the pencil output.
-      - A series of LIN moves to draw the contour.
+      - A series of LIN moves, or a SPLINE block of SPL points, to draw the
+        contour.
       - A LIN move to lift the pencil (return to TRAVEL_Z) and turn off the pencil output.
 
     Parameters:
-      contours (list of np.array): Each element is an (N,2) array containing
-                                   points [X, Y] in the robot coordinate system.
-      save (bool): Whether to save the KRL source code to a file.
-      filename (str): Name of the output KRL source file.
-      :param scale: stuff
+      contours (ContourSet or list of np.array): Each contour is an (N,2) array
+                                   containing points [X, Y] in the robot
+                                   coordinate system.
+      scale (np.array): Size [X, Y] of the drawing area in mm.
+      border (np.array): Border [X, Y] in mm kept free on each side.
+      mode (str): "preserve" keeps the aspect ratio, "scale_paper" stretches
+                  the drawing to the drawing area.
+      base_id (int): Base used by the program.
+      tool_id (int): Tool used by the program.
+      step (float): Distance between the drawn points in mm.
+      optimize (bool): Reorder, reverse and rotate the contours to minimize
+                       the pen-up travel between them.
+      tolerance (float): Max deviation in mm of the drawn path from the
+                         smoothed contour. If set, points are spaced by
+                         curvature instead of every step mm.
+      overlap_tolerance (float): If set, strokes within this distance in mm
+                                 of other strokes are dropped or trimmed,
+                                 see dedupe.remove_overlaps.
+      chain_gap (float): If set, contours whose endpoints are at most this
+                         far apart in mm are drawn as one stroke, see
+                         chaining.chain_contours.
+      motion (str): "lin" draws with approximated LIN moves, "spline" with
+                    one SPLINE block per contour. The SPL points are placed
+                    within tolerance, SPLINE_TOLERANCE if it is not set, of
+                    the smoothed contour.
+      workers (int): Number of workers smoothing the contours in parallel.
+                     None or 1 smooths serially. The output is the same.
+      pool (str): "process" or "thread" pool for the workers.
+      block_cache (StageCache): Cache of the blocks of single contours, so
+                                only new or changed contours are smoothed.
+                                None disables it.
+      progress (callable): Called as progress(stage, fraction) while the
+                           contours are smoothed ("smooth") and their
+                           blocks are written ("emit").
+
+    Yields:
+      str: Chunks of the program: the header, one block per contour and the
+           footer. Every line is terminated by a newline.
     """
     if scale is None:
         scale = np.array([1, 1])
     if border is None:
         border = np.array([20, 20])
+    if motion not in MOTION_MODES:
+        raise ValueError(f"Unknown motion {motion!r}, choose from {', '.join(MOTION_MODES)}")
+    if motion == "spline" and not tolerance:
+        tolerance = SPLINE_TOLERANCE
 
-    krl_lines = []
     # KUKA header and program definition
-    krl_lines.append("&ACCESS RVP")
-    krl_lines.append("&REL 1")
-    krl_lines.append("DEF DRAW_PICTURE()")
-    krl_lines.append("; Define home position (pencil up)")
-    krl_lines.append("POS p_home")
-    krl_lines.append(
-        f"p_home = {{X {HOME_X:.2f}, Y {HOME_Y:.2f}, Z {TRAVEL_Z:.2f}, A 0, B 0, C 0}}"
-    )
-    krl_lines.append("")
-    krl_lines.append("")
-    krl_lines.append("BAS(#initmov, 0)")
-    krl_lines.append(f"BAS(#tool, {tool_id})")
-    krl_lines.append(f"BAS(#base, {base_id})")
-    krl_lines.append("")
-    krl_lines.append("PTP $axis_act")
-    krl_lines.append("PTP p_home")
-    krl_lines.append("")
+    yield ("&ACCESS RVP\n"
+           "&REL 1\n"
+           f"DEF {PROGRAM_NAME}()\n"
+           "; Define home position (pencil up)\n"
+           "POS p_home\n"
+           f"p_home = {{X {HOME_X:.2f}, Y {HOME_Y:.2f}, Z {TRAVEL_Z:.2f}, A 0, B 0, C 0}}\n"
+           "\n"
+           "\n"
+           "BAS(#initmov, 0)\n"
+           f"BAS(#tool, {tool_id})\n"
+           f"BAS(#base, {base_id})\n"
+           "\n"
+           "PTP $axis_act\n"
+           "PTP p_home\n"
+           "\n")
+
+    contours = scale_contours(contours, scale, border, mode)
+
+    if overlap_tolerance:
+        contours, overlap = dedupe.remove_overlaps(contours, overlap_tolerance)
+        print(f"Removed {overlap['length_removed']:.2f} mm of {overlap['length_before']:.2f} mm overlapping path "
+              f"length ({overlap['dropped']} contours dropped, {overlap['trimmed']} trimmed)")
+
+    if chain_gap:
+        contours, chains = chaining.chain_contours(contours, chain_gap)
+        print(f"Chained {chains['contours']} contours into {chains['chains']} strokes, saving "
+              f"{chains['contours'] - chains['chains']} pen lifts")
+
+    if optimize:
+        contours, travel = path_optimizer.optimize_order(contours, home=(HOME_X, HOME_Y))
+        print(f"Pen-up travel reduced from {travel['travel_before']:.2f} mm to {travel['travel_after']:.2f} mm")
 
-    # Determine the maximum dimensions across all contours
-    max_x = np.max([np.max(cont[:, 0]) for cont in contours])
-    max_y = np.max([np.max(cont[:, 1]) for cont in contours])
+    # Process each contour
+    fixed_points = 0
+    total_points = 0
+    numbers = [i for i, contour in enumerate(contours) if contour.size != 0]
+    contours = [contours[i] for i in numbers]
+
+    # Look up the blocks of unchanged contours, smooth (interpolate) the others
+    keys = [block_key(contour, step, tolerance, motion) for contour in contours]
+    blocks = [block_cache.get("block", key) for key in keys] if block_cache is not None else [None] * len(keys)
+    missing = [contour for contour, block in zip(contours, blocks) if block is None]
+    smoothed = iter_smoothed(missing, distance=step, tolerance=tolerance, workers=workers, pool=pool,
+                             spline=motion == "spline")
+    if progress and not missing:
+        progress("smooth", 1.0)
+    num_smoothed = 0
+    for n, (i, contour, key, block) in enumerate(zip(numbers, contours, keys, blocks)):
+        if block is None:
+            smooth_pts = next(smoothed)
+            block = (format_contour_moves(smooth_pts, motion), len(smooth_pts))
+            if block_cache is not None:
+                block_cache.put("block", key, block)
+            num_smoothed += 1
+            if progress:
+                progress("smooth", num_smoothed / len(missing))
+        moves, num_points = block
+        print(f"Writing Contour {i+1} with {num_points} points")
+        if tolerance and len(contour) > 1:
+            fixed_points += num_resampled_points(contour, step)
+            total_points += num_points
+
+        if progress:
+            progress("emit", (n + 1) / len(contours))
+        yield format_contour_header(i + 1) + moves
+
+    if block_cache is not None:
+        print(f"Reused {len(contours) - len(missing)} of {len(contours)} contour blocks")
+    if tolerance:
+        print(f"Adaptive resampling: {total_points} points within {tolerance} mm instead of {fixed_points} points "
+              f"every {step} mm")
 
-    min_x = np.min([np.min(cont[:, 0]) for cont in contours])
-    min_y = np.min([np.min(cont[:, 1]) for cont in contours])
+    # Return to home position at the end.
+    yield PROGRAM_FOOTER
 
-    diff = [max_x - min_x, max_y - min_y]
 
-    true_scaling = scale - 2 * border
+def write_krl_script(chunks, filename="draw.src"):
+    """
+    Write KRL chunks to a file as they are generated.
 
-    # scale Points
-    match mode:
-        case "preserve":
-            scale_fac = min(true_scaling)
+    Parameters:
+      chunks (iterable of str): Chunks as yielded by iter_krl_script.
+      filename (str): Name of the output KRL source file.
+    """
+    with open(filename, "w") as f:
+        f.writelines(chunks)
+    print(f"KRL script saved to '{filename}'")
 
-            contours = [(cont - [min_x, min_y]) / diff * scale_fac + border for cont in contours]
 
-        case "scale_paper":
+def split_krl_script(script, max_points=None, max_bytes=None):
+    """
+    Split a program into parts called in order by a master program, so no
+    single file grows too large to transfer, load or edit on the controller.
+
+    Splits fall on contour boundaries, every part starts with the pen up and
+    is filled with contours until the next one would exceed a budget. A
+    contour exceeding a budget on its own gets a part of its own. The files
+    are:
+      - PROGRAM_NAME, the master program, which calls RESUME_NAME(1).
+      - RESUME_NAME(FIRST), which initializes the robot and draws the parts
+        from FIRST on, to resume an interrupted drawing from a part.
+      - One PART_NAME program per part.
 
-            contours = [(cont - [min_x, min_y]) / diff * true_scaling + border for cont in contours]
+    Parameters:
+      script (str): A program as generated by iter_krl_script.
+      max_points (int): Max number of moves per part, None for no limit.
+      max_bytes (int): Max size of a part file in bytes, None for no limit.
 
+    Returns:
+      iterator of (str, str): The file names and texts of the programs, the
+                              parts are formatted one at a time.
 
-    # Process each contour
-    for i, contour in enumerate(contours):
-        if contour.size == 0:
-            continue
-
-        # Smooth (interpolate) the contour
-        smooth_pts = smooth_contour(contour, distance=step)
-        print(f"Writing Contour {i+1} with {len(smooth_pts)} points")
-
-        krl_lines.append(f"; ----- Contour {i + 1} -----")
-
-        # Move with pencil up (PTP) to starting point.
-        start_x, start_y = smooth_pts[0]
-        krl_lines.append(
-            f"PTP {{X {start_x:.2f}, Y {start_y:.2f}, Z {TRAVEL_Z:.2f}, A 0, B 0, C 0}}"
-        )
-        # Lower the pencil using a LIN move.
-        krl_lines.append(
-            f"LIN {{X {start_x:.2f}, Y {start_y:.2f}, Z {DRAW_Z:.2f}, A 0, B 0, C 0}}"
-        )
-        krl_lines.append(
-            "WAIT SEC 0.1"
-        )
-        # Draw the contour with LIN moves.
-        for pt in smooth_pts[1:]:
-            x, y = pt
-            krl_lines.append(
-                f"LIN {{X {x:.2f}, Y {y:.2f}, Z {DRAW_Z:.2f}, A 0, B 0, C 0}} C_DIS"
-            )
-        # End the contour by lifting the pencil.
-        last_x, last_y = smooth_pts[-1]
-        krl_lines.append(
-            f"LIN {{X {last_x:.2f}, Y {last_y:.2f}, Z {TRAVEL_Z:.2f}, A 0, B 0, C 0}}"
-        )
-        krl_lines.append("")
+    Raises:
+      ValueError: If the script is not a program of iter_krl_script.
+    """
+    # Scripts edited in the web interface may have other line endings
+    script = script.replace("\r\n", "\n").rstrip() + "\n"
+    definition = f"DEF {PROGRAM_NAME}()\n"
+    if definition not in script or not script.endswith(PROGRAM_FOOTER):
+        raise ValueError(f"Not a drawing program, {definition.strip()} or its footer is missing")
+    end = len(script) - len(PROGRAM_FOOTER)
+    matches = list(CONTOUR_HEADER_PATTERN.finditer(script, 0, end))
+    starts = [match.start() for match in matches]
+    header = script[:starts[0] if starts else end]
+
+    # Group the contour blocks into parts, given by their first and last block
+    parts = []
+    overhead = len("&ACCESS RVP\n&REL 1\nDEF " + PART_NAME.format(0) + "()\nEND\n")
+    points = size = 0
+    for i, (start, stop) in enumerate(zip(starts, starts[1:] + [end])):
+        block_points = script.count("{X ", start, stop)
+        block_size = len(script[start:stop].encode())
+        if not parts or (max_points and points + block_points > max_points) or (
+                max_bytes and size + block_size > max_bytes):
+            parts.append([i, i])
+            points, size = 0, overhead
+        parts[-1][1] = i
+        points += block_points
+        size += block_size
+
+    # The resume program returns to p_home at its end, declare it if an edited header does not
+    declaration = f"DEF {RESUME_NAME}(FIRST :IN)\nINT FIRST\n"
+    resume = header
+    if not HOME_DECLARATION_PATTERN.search(header):
+        declaration += "POS p_home\n"
+        body = header.index(definition) + len(definition)
+        statement = STATEMENT_PATTERN.search(header, body)
+        position = statement.start() if statement else len(header)
+        resume = (header[:position] + f"p_home = {{X {HOME_X:.2f}, Y {HOME_Y:.2f}, Z {TRAVEL_Z:.2f}, A 0, B 0, C 0}}\n"
+                  + header[position:])
+    resume = resume.replace(definition, declaration, 1)
+    for number, (first, last) in enumerate(parts, 1):
+        drawn = f"Contour {matches[first][1]}"
+        if last > first:
+            drawn = f"Contours {matches[first][1]} to {matches[last][1]}"
+        resume += f"IF FIRST <= {number} THEN\n  {PART_NAME.format(number)}() ; {drawn}\nENDIF\n"
+    resume += PROGRAM_FOOTER
+    if parts:
+        comment = (f"; Draws parts 1 to {len(parts)}. To resume an interrupted drawing from part n, "
+                   f"call {RESUME_NAME}(n)\n")
+    else:
+        comment = "; The drawing has no contours\n"
+    master = header[:header.index(definition)] + definition + comment + f"{RESUME_NAME}(1)\nEND\n"
+
+    def modules():
+        yield f"{PROGRAM_NAME.lower()}.src", master
+        yield f"{RESUME_NAME.lower()}.src", resume
+        for number, (first, last) in enumerate(parts, 1):
+            stop = starts[last + 1] if last + 1 < len(starts) else end
+            yield (f"{PART_NAME.format(number).lower()}.src",
+                   f"&ACCESS RVP\n&REL 1\nDEF {PART_NAME.format(number)}()\n{script[starts[first]:stop]}END\n")
+
+    return modules()
+
+
+def write_krl_modules(modules, directory):
+    """
+    Write the programs of split_krl_script to a directory.
 
-    # Return to home position at the end.
-    krl_lines.append("PTP p_home")
-    krl_lines.append("END")
+    Parameters:
+      modules (iterable of (str, str)): File names and texts of the programs.
+      directory (str): The output directory, created if it does not exist.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, text in modules:
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(text)
+    print(f"KRL programs saved to '{directory}'")
+
+
+def generate_krl_script(contours, save=True, filename="draw.src", scale=None, border=None, mode="preserve", base_id=3,
+                        tool_id=3, step=2, optimize=False, tolerance=TOLERANCE, overlap_tolerance=None,
+                        chain_gap=None, motion=MOTION, workers=WORKERS, pool=POOL, block_cache=BLOCK_CACHE,
+                        max_points=None, max_bytes=None):
+    """
+    Generates a KUKA KRL source file that instructs a 6-axis robot to draw
+    the lines defined by the given (smoothed) contours.
 
+    See iter_krl_script for the drawing instructions and the remaining
+    parameters. Prefer iter_krl_script for large drawings, it does not hold
+    the whole program in memory.
 
-    if save:
+    Parameters:
+      contours (ContourSet or list of np.array): Each contour is an (N,2) array
+                                   containing points [X, Y] in the robot
+                                   coordinate system.
+      save (bool): Whether to save the KRL source code to a file.
+      filename (str): Name of the output KRL source file.
+      max_points (int): If this or max_bytes is set, the program is saved
+                        split into parts of at most this many moves, see
+                        split_krl_script, in a directory named like the
+                        file without its extension.
+      max_bytes (int): Max size in bytes of the saved parts.
+
+    Returns:
+      list of str: The lines of the KRL program, not split into parts.
+    """
+    script = "".join(iter_krl_script(contours, scale=scale, border=border, mode=mode, base_id=base_id,
+                                     tool_id=tool_id, step=step, optimize=optimize, tolerance=tolerance,
+                                     overlap_tolerance=overlap_tolerance, chain_gap=chain_gap, motion=motion,
+                                     workers=workers, pool=pool, block_cache=block_cache))
+
+    if save and (max_points or max_bytes):
+        # Write the master program, the resume entry point and the parts to a directory.
+        write_krl_modules(split_krl_script(script, max_points, max_bytes), os.path.splitext(filename)[0])
+    elif save:
         # Write the KRL source code to the output file.
-        with open(filename, "w") as f:
-            for line in krl_lines:
-                f.write(line + "\n")
-        print(f"KRL script saved to '{filename}'")
+        write_krl_script([script], filename)
 
-    return krl_lines
+    return script.split("\n")[:-1]
 
 # ===========================================================
 # Main Script Execution
@@ -0,0 +1,165 @@
+"""
+Removal of duplicate and near-coincident strokes.
+
+Adaptive thresholding turns a thin line into a thin blob, whose contour
+runs along both sides of the line, and parallel edges of nearby shapes end
+up as separate contours a fraction of a millimetre apart. Drawn with a pen,
+these strokes cover the same paper twice. This module drops the parts of the
+contours that lie within a tolerance of strokes that are drawn anyway:
+
+  - every contour is resampled densely and the samples are put in a KD-tree,
+  - contours are visited from the longest to the shortest, so long strokes
+    are kept whole and short duplicates are dropped,
+  - a sample is covered if a kept sample of another contour, or of the same
+    contour further back along its path, is within the tolerance,
+  - covered stretches shorter than a minimum overlap (crossing strokes) are
+    drawn anyway, and pieces too short to be worth drawing are dropped.
+
+Contours without overlap are returned unchanged, trimmed contours are split
+into pieces of their resampled points.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from website.kuka.geometry import is_closed
+
+# ===========================================================
+# Configuration Parameters (adjust as needed)
+# ===========================================================
+OVERLAP_TOLERANCE = 0.5  # Max distance in mm between strokes drawn on top of each other
+MIN_OVERLAP = 2.0  # Overlaps shorter than this (in mm) are drawn anyway, e.g. where strokes cross
+MIN_PIECE = 1.0  # Pieces of trimmed contours shorter than this (in mm) are dropped
+SELF_GAP = 3.0  # Samples of one contour overlap only if they are this many tolerances apart along it
+
+
+# ===========================================================
+# Helper Functions
+# ===========================================================
+def resample(contour, spacing):
+    """
+    Insert points into every segment of a contour so that consecutive points
+    are at most ``spacing`` apart.
+
+    Returns:
+      tuple: The (M,2) points and their distance along the contour.
+    """
+    segments = np.diff(contour, axis=0)
+    lengths = np.hypot(*segments.T)
+    counts = np.maximum(np.ceil(lengths / spacing).astype(int), 1)
+    segment_idx = np.repeat(np.arange(len(segments)), counts)
+    fractions = np.arange(len(segment_idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+    fractions = fractions / counts[segment_idx]
+    points = np.vstack((contour[segment_idx] + fractions[:, None] * segments[segment_idx], contour[-1:]))
+    arc = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(points, axis=0).T))))
+    return points, arc
+
+
+def runs(mask):
+    """(start, end) index pairs of the runs of True values in a boolean array."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def _pieces(points, draw, closed):
+    """The runs of drawn samples as contours, joined across the start of a closed contour."""
+    pieces = [points[start:end] for start, end in runs(draw) if end - start > 1]
+    if closed and len(pieces) > 1 and draw[0] and draw[-1]:
+        first, last = pieces[0], pieces.pop()
+        if np.array_equal(first[0], last[-1]):
+            first = first[1:]
+        pieces[0] = np.vstack((last, first))
+    return pieces
+
+
+def _trim(covered, arc, min_overlap, min_piece):
+    """Samples to draw: uncovered ones and short overlaps, without short leftover pieces."""
+    draw = ~covered
+    for start, end in runs(covered):
+        if arc[end - 1] - arc[start] < min_overlap:
+            draw[start:end] = True
+    if not draw.all():
+        for start, end in runs(draw):
+            if arc[end - 1] - arc[start] < min_piece:
+                draw[start:end] = False
+    return draw
+
+
+# ===========================================================
+# Public Interface
+# ===========================================================
+def remove_overlaps(contours, tolerance=OVERLAP_TOLERANCE, min_overlap=MIN_OVERLAP, min_piece=MIN_PIECE):
+    """
+    Drop the contours and contour segments that lie within ``tolerance`` of
+    strokes that are kept.
+
+    Parameters:
+      contours (list of np.array): Each element is an (N,2) array of points
+                                   in the robot coordinate system.
+      tolerance (float): Max distance in mm between two strokes for one of
+                         them to be dropped.
+      min_overlap (float): Overlaps shorter than this are drawn anyway.
+      min_piece (float): Pieces of trimmed contours shorter than this are
+                         dropped.
+
+    Returns:
+      tuple: The remaining contours in their original order, with trimmed
+             contours replaced by their pieces, and a dict with the path
+             length before and the path length removed, and the number of
+             dropped and trimmed contours.
+    """
+    contours = [np.asarray(c, dtype=float) for c in contours if len(c) > 0]
+    stats = {"length_before": 0.0, "length_removed": 0.0, "dropped": 0, "trimmed": 0}
+    if not contours:
+        return contours, stats
+
+    sampled = [resample(c, tolerance / 2) if len(c) > 1 else (c, np.zeros(1)) for c in contours]
+    counts = np.array([len(points) for points, _ in sampled])
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    points = np.vstack([points for points, _ in sampled])
+    arc = np.concatenate([arc for _, arc in sampled])
+    owner = np.repeat(np.arange(len(contours)), counts)
+    total = np.array([a[-1] for _, a in sampled])
+    closed = np.array([is_closed(c) for c in contours])
+    stats["length_before"] = float(total.sum())
+
+    # All pairs of samples within the tolerance, in both directions
+    pairs = cKDTree(points).query_pairs(tolerance, output_type="ndarray")
+    a, b = np.concatenate((pairs[:, 0], pairs[:, 1])), np.concatenate((pairs[:, 1], pairs[:, 0]))
+    # Samples of one contour only overlap if they are far apart along it, not just neighbours
+    same = owner[a] == owner[b]
+    along = np.abs(arc[a] - arc[b])
+    along = np.where(closed[owner[a]], np.minimum(along, total[owner[a]] - along), along)
+    valid = ~same | (along > SELF_GAP * tolerance)
+    a, b, same = a[valid], b[valid], same[valid]
+    order = np.argsort(a, kind="stable")
+    a, b, same = a[order], b[order], same[order]
+    bounds = np.searchsorted(a, offsets)
+
+    kept = np.zeros(len(points), dtype=bool)
+    draws = [None] * len(contours)
+    for c in np.argsort(-total, kind="stable"):
+        lo, hi = offsets[c], offsets[c + 1]
+        ca, cb, csame = a[bounds[c]:bounds[c + 1]], b[bounds[c]:bounds[c + 1]], same[bounds[c]:bounds[c + 1]]
+        covered = np.zeros(hi - lo, dtype=bool)
+        other = ~csame
+        np.logical_or.at(covered, ca[other] - lo, kept[cb[other]])
+        # Overlaps within the contour: a sample is covered by an earlier, uncovered one
+        for i, j in zip(ca[csame] - lo, cb[csame] - lo):
+            if j < i and not covered[j]:
+                covered[i] = True
+        draw = _trim(covered, arc[lo:hi], min_overlap, min_piece)
+        kept[lo:hi] = draw
+        draws[c] = draw
+
+    result = []
+    for c, (contour, (samples, _), draw) in enumerate(zip(contours, sampled, draws)):
+        if draw.all():
+            result.append(contour)
+            continue
+        pieces = _pieces(samples, draw, closed[c])
+        stats["dropped" if not pieces else "trimmed"] += 1
+        stats["length_removed"] += total[c] - sum(np.sum(np.hypot(*np.diff(p, axis=0).T)) for p in pieces)
+        result.extend(pieces)
+    stats["length_removed"] = float(stats["length_removed"])
+    return result, stats
@@ -0,0 +1,68 @@
+"""
+Polyline geometry shared by the KRL generator, its post-processing steps
+and the plotter.
+
+Both the converter and the plotter simplify polylines within a tolerance:
+the converter drops the points of the resampled contours that the drawn
+path does not need, the plotter the points that are not visible at the
+screen resolution. The path optimizer and the stroke deduplication agree
+on which contours are closed loops through is_closed.
+"""
+
+import numpy as np
+
+CLOSED_TOLERANCE = 0.5  # Max gap between first and last point of a closed contour
+
+
+def is_closed(contour, tolerance=CLOSED_TOLERANCE):
+    """Return True if the first and last point of the contour (nearly) coincide."""
+    return len(contour) > 2 and np.hypot(*(contour[0] - contour[-1])) <= tolerance
+
+
+def simplify_polyline(points, tolerance, fixed=None):
+    """
+    Ramer-Douglas-Peucker simplification of a polyline.
+
+    All segments of one recursion level are split at once, so every level is
+    a handful of vectorized operations over all points.
+
+    Parameters:
+      points (np.array): An (N, 2) array of (x, y) points.
+      tolerance (float): Maximum distance of a dropped point from the
+                         simplified polyline.
+      fixed (np.array): Indices of points that are always kept. Passing the
+                        first and last point of every contour of a
+                        concatenated buffer simplifies all contours at once.
+
+    Returns:
+      np.array: The sorted indices of the points to keep.
+    """
+    n = len(points)
+    if n < 3:
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    if fixed is not None:
+        keep[fixed] = True
+    while True:
+        idx = np.flatnonzero(keep)
+        # Segment of the current simplification each point belongs to.
+        seg = np.minimum(np.searchsorted(idx, np.arange(n), side="right") - 1, len(idx) - 2)
+        a = points[idx[seg]]
+        ab = points[idx[seg + 1]] - a
+        ap = points - a
+
+        # Distance of each point to its segment.
+        length_sq = np.sum(ab ** 2, axis=1)
+        t = np.clip(np.sum(ap * ab, axis=1) / np.where(length_sq > 0, length_sq, 1), 0, 1)
+        dist = np.hypot(*(ap - t[:, None] * ab).T)
+        dist[keep] = 0
+
+        # Split every segment at its farthest point if that is out of tolerance.
+        seg_max = np.maximum.reduceat(dist, idx[:-1])
+        split = (dist > tolerance) & (dist == seg_max[seg])
+        if not np.any(split):
+            return idx
+        _, first = np.unique(seg[split], return_index=True)
+        keep[np.flatnonzero(split)[first]] = True
@@ -0,0 +1,361 @@
+"""
+Pen-up travel optimization for contour drawings.
+
+The contours returned by the image processing come in the order the contour
+finder visited them, which makes the robot zig-zag across the sheet between
+every contour. This module reorders the contours to shorten the pen-up moves:
+
+  - a greedy nearest-neighbour tour over the contour endpoints, backed by a
+    KD-tree so it scales to thousands of contours,
+  - 2-opt and Or-opt refinement restricted to spatial neighbours,
+  - reversal of open contours and entry point selection for closed contours.
+
+The tour starts and ends at the home position, as the generated KRL program
+does.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from website.kuka.geometry import CLOSED_TOLERANCE, is_closed
+
+# ===========================================================
+# Configuration Parameters (adjust as needed)
+# ===========================================================
+ENTRY_SAMPLES = 32  # Entry point candidates per closed contour for the greedy tour
+NEIGHBOURS = 8  # Spatial neighbours considered by the local search
+MAX_PASSES = 10  # Maximum number of local search passes
+MIN_IMPROVEMENT = 0.001  # Stop once a pass shortens the travel by less than this fraction
+
+
+# ===========================================================
+# Helper Functions
+# ===========================================================
+def travel_distance(contours, home=(0.0, 0.0)):
+    """
+    Total pen-up travel distance of drawing the contours in the given order,
+    starting and ending at the home position.
+
+    Parameters:
+      contours (list of np.array): Each element is an (N,2) array of points.
+      home (tuple): The (x, y) position the robot starts and ends at.
+
+    Returns:
+      float: The summed length of all travel moves.
+    """
+    if len(contours) == 0:
+        return 0.0
+    home = np.asarray(home, dtype=float)
+    starts = np.array([c[0] for c in contours], dtype=float)
+    ends = np.array([c[-1] for c in contours], dtype=float)
+    exits = np.vstack((home, ends))
+    entries = np.vstack((starts, home))
+    return float(np.sum(np.hypot(*(entries - exits).T)))
+
+
+# ===========================================================
+# Tour State
+# ===========================================================
+class _Tour:
+    """
+    A tour over contours. Position ``p`` of the tour draws contour ``order[p]``,
+    entering it at ``entry[p]`` and leaving it at ``exit[p]``. Open contours
+    can be flipped, closed contours have a selectable entry point and leave
+    where they were entered.
+
+    ``entry`` and ``exit`` carry one extra row holding the home position, so
+    ``exit[p - 1]`` and ``entry[p + 1]`` are valid for the first and last
+    position of the tour.
+    """
+
+    def __init__(self, contours, closed, home):
+        self.contours = contours
+        self.closed = closed
+        self.n = n = len(contours)
+        self.order = np.arange(n)
+        self.flipped = np.zeros(n, dtype=bool)
+        self.entry_idx = np.zeros(n, dtype=int)  # indexed by contour id
+        self.entry = np.empty((n + 1, 2))
+        self.exit = np.empty((n + 1, 2))
+        self.entry[n] = self.exit[n] = home
+
+    def set_position(self, p, contour_id, flipped=False, entry_idx=0):
+        c = self.contours[contour_id]
+        self.order[p] = contour_id
+        self.flipped[p] = flipped
+        if self.closed[contour_id]:
+            self.entry_idx[contour_id] = entry_idx
+            self.entry[p] = self.exit[p] = c[entry_idx]
+        elif flipped:
+            self.entry[p], self.exit[p] = c[-1], c[0]
+        else:
+            self.entry[p], self.exit[p] = c[0], c[-1]
+
+    def length(self):
+        return float(np.sum(_dist(self.entry, np.roll(self.exit, 1, axis=0))))
+
+    def positions(self):
+        pos = np.empty(self.n, dtype=int)
+        pos[self.order] = np.arange(self.n)
+        return pos
+
+    def reverse(self, i, j):
+        """Reverse the positions i..j (inclusive), flipping each contour."""
+        sl = slice(i, j + 1)
+        self.order[sl] = self.order[sl][::-1]
+        self.flipped[sl] = ~self.flipped[sl][::-1]
+        entry = self.entry[sl][::-1].copy()
+        self.entry[sl] = self.exit[sl][::-1]
+        self.exit[sl] = entry
+
+    def move(self, i, length, p, reverse):
+        """Move the segment of ``length`` positions starting at i behind position p."""
+        idx = np.arange(self.n)
+        segment = idx[i:i + length]
+        rest = np.concatenate((idx[:i], idx[i + length:]))
+        insert_at = p + 1 if p < i else p + 1 - length
+        if reverse:
+            segment = segment[::-1]
+        perm = np.concatenate((rest[:insert_at], segment, rest[insert_at:]))
+
+        self.order = self.order[perm]
+        self.flipped = self.flipped[perm]
+        self.entry[:self.n] = self.entry[perm]
+        self.exit[:self.n] = self.exit[perm]
+        if reverse:
+            sl = slice(insert_at, insert_at + length)
+            self.flipped[sl] = ~self.flipped[sl]
+            entry = self.entry[sl].copy()
+            self.entry[sl] = self.exit[sl]
+            self.exit[sl] = entry
+
+    def materialize(self, tolerance):
+        result = []
+        for p, cid in enumerate(self.order):
+            c = self.contours[cid]
+            if self.closed[cid]:
+                k = self.entry_idx[cid]
+                ring = _ring(c, tolerance)
+                c = np.concatenate((ring[k:], ring[:k + 1]))
+                # The spline fit needs strictly increasing arc length.
+                c = c[np.r_[True, np.any(c[1:] != c[:-1], axis=1)]]
+            if self.flipped[p]:
+                c = c[::-1]
+            result.append(c)
+        return result
+
+
+def _ring(contour, tolerance):
+    """The points of a closed contour without the duplicated closing point."""
+    return contour[:-1] if np.hypot(*(contour[0] - contour[-1])) <= tolerance else contour
+
+
+def _dist(a, b):
+    return np.hypot(a[..., 0] - b[..., 0], a[..., 1] - b[..., 1])
+
+
+# ===========================================================
+# Tour Construction
+# ===========================================================
+def _greedy(tour, entry_samples):
+    """Build a nearest-neighbour tour starting at the home position."""
+    contours, closed, n = tour.contours, tour.closed, tour.n
+
+    # Candidate entry points: both ends of open contours, a sample of the
+    # points of closed contours.
+    points, owner, index = [], [], []
+    for cid, c in enumerate(contours):
+        if closed[cid]:
+            idx = np.unique(np.linspace(0, len(c) - 2, min(entry_samples, len(c) - 1)).astype(int))
+        else:
+            idx = np.array([0, len(c) - 1])
+        points.append(c[idx])
+        owner.append(np.full(len(idx), cid))
+        index.append(idx)
+    points = np.concatenate(points)
+    owner = np.concatenate(owner)
+    index = np.concatenate(index)
+
+    visited = np.zeros(n, dtype=bool)
+    alive = np.arange(len(points))
+    tree = cKDTree(points)
+    remaining_in_tree = n
+    current = tour.exit[n]
+
+    for p in range(n):
+        # Rebuild the index once most of its contours have been visited so the
+        # queries don't have to skip over dead candidates.
+        if remaining_in_tree > 16 and (n - p) * 2 < remaining_in_tree:
+            alive = alive[~visited[owner[alive]]]
+            tree = cKDTree(points[alive])
+            remaining_in_tree = n - p
+
+        k = NEIGHBOURS
+        while True:
+            k = min(k, len(alive))
+            _, hits = tree.query(current, k=k)
+            hits = alive[np.atleast_1d(hits)]
+            free = hits[~visited[owner[hits]]]
+            if len(free) or k == len(alive):
+                break
+            k *= 4
+        hit = free[0]
+        cid = owner[hit]
+        visited[cid] = True
+        if closed[cid]:
+            tour.set_position(p, cid, entry_idx=index[hit])
+        else:
+            tour.set_position(p, cid, flipped=index[hit] != 0)
+        current = tour.exit[p]
+
+
+# ===========================================================
+# Local Search
+# ===========================================================
+def _best_entries(tour, tolerance):
+    """Pick the entry point of every closed contour given its neighbours in the tour."""
+    improved = False
+    for p, cid in enumerate(tour.order):
+        if not tour.closed[cid]:
+            continue
+        ring = _ring(tour.contours[cid], tolerance)
+        cost = _dist(ring, tour.exit[p - 1]) + _dist(ring, tour.entry[p + 1])
+        k = int(np.argmin(cost))
+        if cost[k] < cost[tour.entry_idx[cid]] - 1e-9:
+            tour.set_position(p, cid, flipped=tour.flipped[p], entry_idx=k)
+            improved = True
+    return improved
+
+
+def _neighbours(tour, neighbours):
+    """The ids of the contours whose exits are closest to the exit of each contour, by position."""
+    k = min(neighbours + 1, tour.n)
+    _, near = cKDTree(tour.exit[:tour.n]).query(tour.exit[:tour.n], k=k)
+    ids = tour.order.copy()
+    return ids, ids[near.reshape(tour.n, k)]
+
+
+def _two_opt(tour, neighbours):
+    """One pass of 2-opt moves between spatially neighbouring exits."""
+    n = tour.n
+    if n < 3:
+        return False
+    improved = False
+    ids, near = _neighbours(tour, neighbours)
+    pos = tour.positions()
+
+    for cid, row in zip(ids, near):
+        # Reversing a+1..b replaces the edges (a, a+1) and (b, b+1) by
+        # (a, b) and (a+1, b+1).
+        a, b = np.minimum(pos[cid], pos[row]), np.maximum(pos[cid], pos[row])
+        if _reverse_best(tour, a, b, pos):
+            improved = True
+
+    # Reversing a prefix of the tour replaces the edge leaving home.
+    b = np.arange(n)
+    if _reverse_best(tour, np.full(n, -1), b, pos):
+        improved = True
+    return improved
+
+
+def _reverse_best(tour, a, b, pos):
+    """Apply the best improving reversal of a+1..b among the candidate pairs."""
+    e_a, s_a1, e_b, s_b1 = tour.exit[a], tour.entry[a + 1], tour.exit[b], tour.entry[b + 1]
+    delta = _dist(e_a, e_b) + _dist(s_a1, s_b1) - _dist(e_a, s_a1) - _dist(e_b, s_b1)
+    delta[a == b] = 0
+    best = int(np.argmin(delta))
+    if delta[best] >= -1e-9:
+        return False
+    lo, hi = a[best] + 1, b[best]
+    tour.reverse(lo, hi)
+    pos[tour.order[lo:hi + 1]] = np.arange(lo, hi + 1)
+    return True
+
+
+def _or_opt(tour, neighbours, max_length=3):
+    """One pass of Or-opt moves: relocate short runs of contours next to a spatial neighbour."""
+    n = tour.n
+    if n < 3:
+        return False
+    improved = False
+    ids, near = _neighbours(tour, neighbours)
+    near_by_id = np.empty_like(near)
+    near_by_id[ids] = near
+    pos = tour.positions()
+
+    for length in range(1, min(max_length, n - 2) + 1):
+        # Only segments whose removal shortens the tour are worth moving.
+        i = np.arange(n - length + 1)
+        j = i + length - 1
+        gain = (_dist(tour.exit[i - 1], tour.entry[i]) + _dist(tour.exit[j], tour.entry[j + 1])
+                - _dist(tour.exit[i - 1], tour.entry[j + 1]))
+        for i in np.flatnonzero(gain > 1e-9):
+            j = i + length - 1
+            prev_e, next_s = tour.exit[i - 1], tour.entry[j + 1]
+            seg_s, seg_e = tour.entry[i], tour.exit[j]
+            gain = _dist(prev_e, seg_s) + _dist(seg_e, next_s) - _dist(prev_e, next_s)
+            if gain <= 1e-9:
+                continue
+
+            # Insert behind a contour near either end of the segment.
+            p = pos[np.concatenate((near_by_id[tour.order[i]], near_by_id[tour.order[j]]))]
+            p = p[(p < i - 1) | (p > j)]
+            if len(p) == 0:
+                continue
+            e_p, s_p1 = tour.exit[p], tour.entry[p + 1]
+            base = _dist(e_p, s_p1) + gain
+            forward = _dist(e_p, seg_s) + _dist(seg_e, s_p1) - base
+            backward = _dist(e_p, seg_e) + _dist(seg_s, s_p1) - base
+            best_f, best_b = int(np.argmin(forward)), int(np.argmin(backward))
+            reverse = backward[best_b] < forward[best_f]
+            best, delta = (p[best_b], backward[best_b]) if reverse else (p[best_f], forward[best_f])
+            if delta < -1e-9:
+                tour.move(i, length, best, reverse)
+                pos = tour.positions()
+                improved = True
+    return improved
+
+
+# ===========================================================
+# Public Interface
+# ===========================================================
+def optimize_order(contours, home=(0.0, 0.0), closed_tolerance=CLOSED_TOLERANCE,
+                   entry_samples=ENTRY_SAMPLES, neighbours=NEIGHBOURS, max_passes=MAX_PASSES):
+    """
+    Reorder, reverse and rotate contours to minimize the pen-up travel distance.
+
+    Parameters:
+      contours (list of np.array): Each element is an (N,2) array of points.
+      home (tuple): The (x, y) position the robot starts and ends at.
+      closed_tolerance (float): Contours whose end points are at most this far
+                                apart are treated as closed and may be entered
+                                at any of their points.
+      entry_samples (int): Number of entry points per closed contour considered
+                           by the greedy construction.
+      neighbours (int): Number of spatial neighbours considered by 2-opt/Or-opt.
+      max_passes (int): Maximum number of local search passes.
+
+    Returns:
+      tuple: The reordered list of contours and a dict with the travel
+             distance before and after the optimization.
+    """
+    contours = [np.asarray(c, dtype=float) for c in contours if len(c) > 0]
+    before = travel_distance(contours, home)
+    if len(contours) < 2 and not any(is_closed(c, closed_tolerance) for c in contours):
+        return contours, {"travel_before": before, "travel_after": before}
+
+    closed = np.array([is_closed(c, closed_tolerance) for c in contours])
+    tour = _Tour(contours, closed, home)
+    _greedy(tour, entry_samples)
+
+    length = tour.length()
+    for _ in range(max_passes):
+        improved = _two_opt(tour, neighbours)
+        improved |= _or_opt(tour, neighbours)
+        improved |= _best_entries(tour, closed_tolerance)
+        previous, length = length, tour.length()
+        if not improved or previous - length < MIN_IMPROVEMENT * previous:
+            break
+
+    result = tour.materialize(closed_tolerance)
+    return result, {"travel_before": before, "travel_after": travel_distance(result, home)}
@@ -1,45 +1,123 @@
+import mmap
+import os
+import re
+
 import numpy as np
 import plotly.graph_objects as go
 from numpy import ndarray
 
+from website.contour_set import ContourSet
+from website.kuka.geometry import simplify_polyline
+from website.kuka.poses import parse_poses, fill_forward
+
+# Contour markers and PTP/LIN moves and SPL points of spline blocks with a
+# pose, e.g. "LIN {X 114.64, Y 204.61, Z 0.00, A 0, B 0, C 0} C_DIS". Moves
+# to named positions such as "PTP p_home" are not matched.
+CONTOUR_MARKER = b"; ----- Contour"
+KRL_PATTERN = re.compile(
+    rb"^(" + re.escape(CONTOUR_MARKER) + rb"|(?:PTP|LIN|SPL)(?=[ \t]*\{))[ \t]*(?:\{([^}\n]*)\})?",
+    re.MULTILINE
+)
+
+# Points per axis a WebGL plot is downsampled to, about the on-screen resolution.
+PLOT_RESOLUTION = 2000
+
+
+def parse_krl(text: str | bytes) -> tuple[ContourSet, ContourSet]:
+    """
+    Parse the moves of a KRL program in one pass over the whole text.
+
+    Returns one (N, 6) array of X, Y, Z, A, B, C per contour, and for every
+    contour an array with the motion type ("PTP", "LIN" or "SPL") of each point,
+    both as a ContourSet. The Z column tells whether the pen is up or down.
+    """
+    if isinstance(text, str):
+        text = text.encode()
+    matches = KRL_PATTERN.findall(text)
+
+    kinds = np.array([kind for kind, _ in matches])
+    is_marker = kinds == CONTOUR_MARKER
+    contour_idx = np.cumsum(is_marker)[~is_marker]
+    n_contours = np.count_nonzero(is_marker)
+    if n_contours == 0:
+        return ContourSet.from_list([]), ContourSet.from_list([])
+
+    # Missing components of a pose keep the value of the pose before
+    coords = fill_forward(parse_poses([pose for kind, pose in matches if kind != CONTOUR_MARKER]))
+    motions = kinds[~is_marker].astype(str)
+
+    # Moves before the first contour belong to none.
+    first = np.searchsorted(contour_idx, 1)
+    offsets = np.searchsorted(contour_idx, np.arange(1, n_contours + 2)) - first
+    return ContourSet(coords[first:], offsets), ContourSet(motions[first:], offsets)
+
+
+def parse_krl_file(filename: str) -> tuple[ContourSet, ContourSet]:
+    """Like parse_krl, but memory-maps the file instead of reading it."""
+    if os.path.getsize(filename) == 0:
+        return ContourSet.from_list([]), ContourSet.from_list([])
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as text:
+        return parse_krl(text)
 
-def str_to_point(line: str) -> list:
-    point = line[:-1].split("{")[1].split("}")[0]
-    point = [float(p.split(" ")[1]) for p in point.split(", ")]
-    return point
 
-def extract(lines: list) -> list[np.ndarray]:
-    points = []
+def extract(lines: list | str) -> ContourSet:
+    if not isinstance(lines, str):
+        lines = "".join(line if line.endswith("\n") else line + "\n" for line in lines)
+    return parse_krl(lines)[0]
 
-    for line in lines:
-        if line.startswith("; ----- Contour"):
-            points.append([])
-        elif not "{" in line:
-            continue
-        elif line.startswith('PTP') or line.startswith('LIN'):
-            points[-1].append(str_to_point(line))
-    points = [np.array(p) for p in points]
-    return points
+def extract_file(filename: str) -> ContourSet:
+    return parse_krl_file(filename)[0]
 
-def extract_file(filename: str) -> list[np.ndarray]:
+def downsample(points: ContourSet, resolution: int = PLOT_RESOLUTION) -> ContourSet:
+    """
+    Drop the points of every contour that are not visible at the given
+    number of pixels across the whole drawing. A contour deviates at most
+    half a pixel from the original one.
+    """
+    points = ContourSet.from_list(points)
+    if len(points.coords) == 0:
+        return points
+    xy = points.coords[:, :2]
+    tolerance = np.max(np.ptp(xy, axis=0)) / resolution / 2
+    nonempty = points.lengths > 0
+    ends = np.concatenate((points.offsets[:-1][nonempty], points.offsets[1:][nonempty] - 1))
+    keep = simplify_polyline(xy, tolerance, fixed=ends)
+    return ContourSet.from_lengths(points.coords[keep], np.bincount(points.contour_index()[keep],
+                                                                    minlength=len(points)))
 
-    with open(filename, 'r') as f:
-        return extract(f.readlines())
 
-def plot_cont(points: list|ndarray, fig: go.Figure = None, show: bool = True) -> None:
+def merged_xy(points: ContourSet) -> tuple[ndarray, ndarray]:
+    """X and Y of all contours in one line, the contours separated by NaN."""
+    xy = np.full((len(points.coords) + len(points), 2), np.nan)
+    xy[np.arange(len(points.coords)) + points.contour_index()] = points.coords[:, :2]
+    return xy[:, 0], xy[:, 1]
+
+
+def plot_cont(points: list|ndarray|ContourSet, fig: go.Figure = None, show: bool = True,
+              visible: ndarray = None, webgl: bool = False, resolution: int = PLOT_RESOLUTION) -> None:
 
     if fig is None:
         fig = go.Figure()
 
-    # Add a trace for each contour
+    # WebGL traces of downsampled contours, still one per contour to hide them separately
+    trace_type = "scatter"
+    if webgl:
+        trace_type = "scattergl"
+        points = downsample(points, resolution)
+
+    # Add a trace for each contour, validated once by add_traces
+    traces = []
     for idx, contour in enumerate(points):
         contour = np.asarray(contour)
-        fig.add_trace(go.Scatter(
+        traces.append(dict(
+            type=trace_type,
             x=contour[:, 0],
             y=contour[:, 1],
             mode='lines',
-            name=f"Contour {idx + 1}"
+            name=f"Contour {idx + 1}",
+            visible=True if visible is None or visible[idx] else 'legendonly'
         ))
+    fig.add_traces(traces)
 
     # Update layout with title, axis labels, and grid lines
     fig.update_layout(
@@ -54,10 +132,58 @@ def plot_cont(points: list|ndarray, fig: go.Figure = None, show: bool = True) ->
     if show:
         fig.show()
 
-def plot_path(points: list|ndarray, fig: go.Figure = None, show: bool = True) -> None:
+def plot_path(points: list|ndarray|ContourSet, fig: go.Figure = None, show: bool = True, webgl: bool = False,
+              resolution: int = PLOT_RESOLUTION) -> None:
 
     if fig is None:
         fig = go.Figure()
+
+    if webgl:
+        add_merged_path(fig, ContourSet.from_list(points), resolution)
+    else:
+        add_path(fig, points)
+
+    points = ContourSet.from_list(points)
+    starts = points.coords[points.offsets[1:-1], :2]
+    ends = points.coords[points.offsets[1:-1] - 1, :2]
+    travel = np.sum(np.hypot(*(starts - ends).T))
+    fig.update_layout(
+        title=f"Robot Path (pen-up travel {travel:.0f} mm)",
+        xaxis_title="X (mm)",
+        yaxis_title="Y (mm)"
+    )
+    # Invert the y-axis so that the origin is at the top-left
+    fig.update_yaxes(showgrid=True)
+    fig.update_xaxes(showgrid=True)
+
+    if show:
+        fig.show()
+
+def add_merged_path(fig: go.Figure, points: ContourSet, resolution: int = PLOT_RESOLUTION) -> None:
+    """The traces of plot_path as four WebGL traces: all contours, starts, ends and moves."""
+    points = points.select(points.lengths > 0)
+    starts = points.coords[points.offsets[:-1], :2]
+    ends = points.coords[points.offsets[1:] - 1, :2]
+
+    # The contours without their first point, which is the pen-up start
+    is_start = np.zeros(len(points.coords), dtype=bool)
+    is_start[points.offsets[:-1]] = True
+    drawn = ContourSet.from_lengths(points.coords[~is_start], points.lengths - 1)
+    x, y = merged_xy(downsample(drawn, resolution))
+    fig.add_trace(go.Scattergl(x=x, y=y, mode='lines+markers', marker=dict(size=2), name="Contour"))
+
+    fig.add_trace(go.Scattergl(x=starts[:, 0], y=starts[:, 1], mode='markers', marker=dict(color='green', size=10),
+                               name="Start"))
+    fig.add_trace(go.Scattergl(x=ends[:, 0], y=ends[:, 1], mode='markers', marker=dict(color='red', size=10),
+                               name="End"))
+
+    # Moves from the end of every contour to the start of the next one, drawn on top
+    moves = ContourSet.from_lengths(np.stack((ends[:-1], starts[1:]), axis=1).reshape(-1, 2),
+                                    np.full(max(len(points) - 1, 0), 2))
+    x, y = merged_xy(moves)
+    fig.add_trace(go.Scattergl(x=x, y=y, mode='lines', line=dict(dash='dash'), name="Move"))
+
+def add_path(fig: go.Figure, points: list|ndarray|ContourSet) -> None:
     last_point = None
 
     # Lists to store non-move and move traces separately.
@@ -124,24 +250,8 @@ def plot_path(points: list|ndarray, fig: go.Figure = None, show: bool = True) ->
 
         last_point = contour[-1]
 
-    # Add non-move traces first...
-    for trace in non_move_traces:
-        fig.add_trace(trace)
-    # ...then add move traces so they are drawn on top.
-    for trace in move_traces:
-        fig.add_trace(trace)
-
-    fig.update_layout(
-        title="Robot Path",
-        xaxis_title="X (mm)",
-        yaxis_title="Y (mm)"
-    )
-    # Invert the y-axis so that the origin is at the top-left
-    fig.update_yaxes(showgrid=True)
-    fig.update_xaxes(showgrid=True)
-
-    if show:
-        fig.show()
+    # Add non-move traces first, then move traces so they are drawn on top.
+    fig.add_traces(non_move_traces + move_traces)
 
 if __name__ == '__main__':
     points = extract_file("../../kuka files/draw.src")
@@ -0,0 +1,62 @@
+"""
+Parsing of the poses of KRL moves, shared by the plotter and the motion
+simulator.
+
+A pose is the text between the braces of a move, e.g.
+"X 114.64, Y 204.61, Z 0.00, A 0, B 0, C 0". Full poses as the converter
+writes them are converted in one go over all poses, others component by
+component.
+"""
+
+import re
+
+import numpy as np
+
+COMPONENTS = b"XYZABC"
+COMPONENT_PATTERN = re.compile(rb"([XYZABC])[ \t]+([-+0-9.eE]+)", re.IGNORECASE)
+_LETTERS = bytes(range(ord("A"), ord("Z") + 1)) + bytes(range(ord("a"), ord("z") + 1))
+_NOT_LETTERS = bytes(sorted(set(range(256)) - set(_LETTERS)))
+
+
+def parse_pose(pose: bytes) -> np.ndarray:
+    """X, Y, Z, A, B, C of one pose, NaN for the components it leaves unchanged."""
+    values = np.full(len(COMPONENTS), np.nan)
+    for key, value in COMPONENT_PATTERN.findall(pose):
+        values[COMPONENTS.index(key.upper())] = float(value)
+    return values
+
+
+def parse_poses(poses: list[bytes]) -> np.ndarray:
+    """
+    X, Y, Z, A, B, C of the poses as an (N, 6) array, NaN for the
+    components a pose leaves unchanged, see fill_forward.
+
+    The fast path drops the keys and converts all values at once, it is only
+    taken when the keys are exactly XYZABC in every pose, so exponents such
+    as 1e2 and partial poses go through parse_pose.
+    """
+    if not poses:
+        return np.empty((0, len(COMPONENTS)))
+    joined = b",".join(poses)
+    if joined.translate(None, _NOT_LETTERS).upper() == COMPONENTS * len(poses):
+        try:
+            return np.array(joined.translate(None, _LETTERS).split(b","), dtype=float).reshape(-1, len(COMPONENTS))
+        except ValueError:
+            pass
+    return np.array([parse_pose(pose) for pose in poses])
+
+
+def fill_forward(values: np.ndarray) -> np.ndarray:
+    """Replace NaN entries by the last value above them in their column, the first value if there is none."""
+    if not np.isnan(values).any():
+        return values
+    values = values.copy()
+    for column in values.T:
+        valid = ~np.isnan(column)
+        if not valid.any():
+            column[:] = 0.0
+            continue
+        idx = np.maximum.accumulate(np.where(valid, np.arange(len(column)), 0))
+        idx[:np.argmax(valid)] = np.argmax(valid)
+        column[:] = column[idx]
+    return values
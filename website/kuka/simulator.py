@@ -0,0 +1,337 @@
+"""
+Cycle-time estimate of KRL drawing programs.
+
+The simulator reads the PTP, LIN, SPL and WAIT SEC statements of a program and
+estimates how long the robot takes to run it, without a robot or a
+controller. Every move follows a trapezoidal velocity profile within the
+configured velocity and acceleration limits:
+
+  - moves without approximation end in an exact stop, as do moves followed
+    by a WAIT or by a move of another motion type,
+  - approximated moves (C_DIS) blend into the next move on an arc that
+    starts at most the approximation distance before the corner, and the
+    speed through the corner is limited by the acceleration on that arc,
+  - SPL points of a SPLINE block are passed on a smooth curve, whose radius
+    at a point is taken from the circle through it and its neighbours,
+  - a forward and a backward pass over all moves limit the speeds to what
+    the acceleration allows between the corners. Both passes are cumulative
+    minima, so a whole program is simulated in a few vectorized operations.
+
+PTP moves are planned in joint space by the controller. Without the robot's
+kinematics they are estimated like Cartesian moves with their own limits.
+The time is broken down into drawing (pen down), travel (pen up), pen lifts
+and lowerings, and waits. estimate_contours estimates the program of a set
+of contours without generating it, for use as a cost function.
+
+Usage: python -m website.kuka.simulator draw.src [--lin-velocity MM_S] [...]
+"""
+
+import argparse
+import mmap
+import os
+import re
+
+import numpy as np
+
+from website.contour_set import ContourSet
+from website.kuka import converter
+from website.kuka.poses import parse_pose, parse_poses, fill_forward
+
+# ===========================================================
+# Configuration Parameters (adjust as needed)
+# ===========================================================
+# Motion limits, set them to the $VEL, $ACC and $APO values the robot runs with
+LIN_VELOCITY = 250.0  # Path velocity of LIN moves in mm/s ($VEL.CP)
+LIN_ACCELERATION = 2000.0  # Path acceleration of LIN moves in mm/s^2 ($ACC.CP)
+PTP_VELOCITY = 500.0  # Cartesian velocity of PTP moves in mm/s
+PTP_ACCELERATION = 4000.0  # Cartesian acceleration of PTP moves in mm/s^2
+APPROXIMATION = 1.0  # Approximation distance of C_DIS moves in mm ($APO.CDIS)
+
+# Moves are pen-down moves below this height, half way between drawing and travel height by default
+PEN_Z = (converter.DRAW_Z + converter.TRAVEL_Z) / 2
+
+PTP, LIN, WAIT, SPL = 0, 1, 2, 3  # Statement kinds
+CATEGORIES = ("draw", "travel", "pen", "wait")  # Parts of the cycle time
+
+MOVE_PATTERN = re.compile(
+    rb"^[ \t]*(?:(PTP|LIN|SPL)[ \t]+(?:\{([^}\n]*)\}|([$\w.]+))[ \t]*(C_DIS|C_PTP|C_VEL|C_ORI)?"
+    rb"|WAIT[ \t]+SEC[ \t]+([-+0-9.eE]+))",
+    re.MULTILINE | re.IGNORECASE
+)
+POSITION_PATTERN = re.compile(rb"^[ \t]*(\w+)[ \t]*=[ \t]*\{([^}\n]*)\}", re.MULTILINE)
+
+
+# ===========================================================
+# Helper Functions
+# ===========================================================
+def _cumulative_limit(limits, increments, initial):
+    """
+    Speeds squared of a pass over the moves: w[i] = min(limits[i], w[i - 1] + increments[i]),
+    with w[-1] = initial, as a cumulative minimum.
+    """
+    offsets = np.cumsum(increments)
+    return offsets + np.minimum(initial, np.minimum.accumulate(limits - offsets))
+
+
+def _move_times(distance, v0, v1, vmax, acceleration):
+    """Duration of trapezoidal moves from speed v0 to v1 within vmax and the acceleration."""
+    peak_sq = np.minimum(vmax ** 2, (2 * acceleration * distance + v0 ** 2 + v1 ** 2) / 2)
+    peak = np.sqrt(np.maximum(peak_sq, np.maximum(v0, v1) ** 2))
+    ramp = (2 * peak - v0 - v1) / acceleration
+    cruise = np.maximum(distance - (2 * peak ** 2 - v0 ** 2 - v1 ** 2) / (2 * acceleration), 0)
+    return ramp + np.divide(cruise, peak, out=np.zeros_like(cruise), where=peak > 0)
+
+
+# ===========================================================
+# Simulation
+# ===========================================================
+def parse_program(text):
+    """
+    Read the motion statements of a KRL program.
+
+    Parameters:
+      text (str, bytes or list of str): The program, e.g. the lines returned
+                                        by converter.generate_krl_script.
+
+    Returns:
+      tuple: The statement kinds (PTP, LIN, SPL or WAIT), an (N,3) array
+             with the X, Y, Z target of every statement (the current
+             position for WAITs and moves to unknown positions), whether
+             each move is approximated, and the seconds of every WAIT.
+    """
+    if isinstance(text, list):
+        text = "\n".join(text)
+    if isinstance(text, str):
+        text = text.encode()
+    positions = {name.lower(): parse_pose(pose)[:3] for name, pose in POSITION_PATTERN.findall(text)}
+    matches = MOVE_PATTERN.findall(text)
+    if not matches:
+        return np.zeros(0, dtype=np.int8), np.empty((0, 3)), np.zeros(0, dtype=bool), np.zeros(0)
+    motion, pose, name, approx, wait = (np.array(column) for column in zip(*matches))
+
+    is_wait = wait != b""
+    initial = motion.astype("S1")
+    kinds = np.select([is_wait, np.isin(initial, (b"P", b"p")), np.isin(initial, (b"S", b"s"))], [WAIT, PTP, SPL],
+                      LIN).astype(np.int8)
+    # The points of a spline block are passed without stopping, up to the last one
+    approximated = (approx != b"") | (kinds == SPL)
+    waits = np.zeros(len(matches))
+    waits[is_wait] = wait[is_wait].astype(float)
+
+    targets = np.full((len(matches), 3), np.nan)
+    with_pose = pose != b""
+    targets[with_pose] = parse_poses(pose[with_pose].tolist())[:, :3]
+    for i in np.flatnonzero(name != b""):
+        # Moves to named positions such as p_home; $axis_act and unknown names stay where the robot is
+        if name[i].lower() in positions:
+            targets[i] = positions[name[i].lower()]
+    return kinds, fill_forward(targets), approximated, waits
+
+
+def simulate(kinds, targets, approximated, waits, lin_velocity=LIN_VELOCITY, lin_acceleration=LIN_ACCELERATION,
+             ptp_velocity=PTP_VELOCITY, ptp_acceleration=PTP_ACCELERATION, approximation=APPROXIMATION):
+    """
+    Time every statement of a program as returned by parse_program.
+
+    Parameters:
+      lin_velocity, ptp_velocity (float): Max velocity in mm/s, the LIN
+                                          limits also apply to SPL points.
+      lin_acceleration, ptp_acceleration (float): Acceleration in mm/s^2.
+      approximation (float): Approximation distance of approximated moves
+                             in mm, 0 stops exactly at every point.
+
+    Returns:
+      tuple: The seconds every statement takes and the distance every
+             statement moves in mm.
+    """
+    times = np.array(waits, dtype=float)
+    if len(kinds) == 0:
+        return times, np.zeros(0)
+    steps = np.diff(targets, axis=0, prepend=targets[:1])
+    distance = np.sqrt(np.sum(steps ** 2, axis=1))
+
+    # Moves of zero length take no time, an exact stop on one applies to the move before it
+    kept = np.flatnonzero((distance > 1e-9) | (kinds == WAIT))
+    if len(kept) == 0:
+        return times, distance
+    approximated = np.minimum.reduceat(approximated.astype(np.int8), kept).astype(bool)
+    kinds, steps, length = kinds[kept], steps[kept], distance[kept]
+    is_ptp = kinds == PTP
+    vmax = np.where(is_ptp, ptp_velocity, lin_velocity)
+    acceleration = np.where(is_ptp, ptp_acceleration, lin_acceleration)
+    vmax[kinds == WAIT] = 0.0
+
+    # Speed limit at the end of every move, blending into the next one on an arc
+    direction = steps / np.where(length > 0, length, 1)[:, None]
+    cos = np.clip(np.sum(direction[:-1] * direction[1:], axis=1), -1, 1)
+    tan_half = np.sqrt((1 - cos) / (1 + cos + 1e-12))
+    reach = np.minimum(approximation, np.minimum(length[:-1], length[1:]) / 2)
+    radius = np.divide(reach, tan_half, out=np.full(len(cos), np.inf), where=tan_half > 0)
+    # Radius of the circle through the start, the corner and the end of two SPL segments
+    sin = np.sqrt(np.maximum(1 - cos ** 2, 0))
+    chord = np.sqrt(np.sum((steps[:-1] + steps[1:]) ** 2, axis=1))
+    circle = np.divide(chord, 2 * sin, out=np.full(len(cos), np.inf), where=sin > 1e-12)
+    # Turns sharper than a right angle are passed no faster than a blended corner
+    circle[cos < 0] = np.minimum(circle[cos < 0], reach[cos < 0])
+    radius = np.where(kinds[:-1] == SPL, circle, radius)
+    corner = np.sqrt(np.minimum(acceleration[:-1], acceleration[1:]) * radius)
+    corner = np.minimum(corner, np.minimum(vmax[:-1], vmax[1:]))
+    blends = approximated[:-1] & (kinds[:-1] == kinds[1:]) & (kinds[1:] != WAIT)
+    limit = np.append(np.where(blends, corner, 0.0), 0.0) ** 2
+
+    # Forward pass: accelerate from the previous corner, backward pass: brake for the next one
+    increments = 2 * acceleration * length
+    exit_sq = _cumulative_limit(limit, increments, 0.0)
+    exit_sq = _cumulative_limit(exit_sq[::-1], np.append(0.0, increments[:0:-1]), np.inf)[::-1]
+    exit_speed = np.sqrt(np.maximum(exit_sq, 0))
+    entry_speed = np.append(0.0, exit_speed[:-1])
+
+    moving = kinds != WAIT
+    times[kept[moving]] = _move_times(length[moving], entry_speed[moving], exit_speed[moving], vmax[moving],
+                                      acceleration[moving])
+    return times, distance
+
+
+def breakdown(kinds, targets, times, distance, pen_z=PEN_Z):
+    """
+    Sum the statement times up by category.
+
+    Returns:
+      dict: The total seconds, the seconds spent drawing, travelling,
+            lifting and lowering the pen and waiting, the number of moves
+            and pen lifts, and the drawn and travelled distance in mm.
+    """
+    start = np.vstack((targets[:1], targets[:-1]))
+    down = (start[:, 2] < pen_z) & (targets[:, 2] < pen_z)
+    vertical = np.hypot(*(targets[:, :2] - start[:, :2]).T) <= 1e-9
+    category = np.where(kinds == WAIT, 3, np.where(vertical & (distance > 0), 2, np.where(down, 0, 1)))
+    seconds = np.bincount(category, weights=times, minlength=4)
+    lengths = np.bincount(category, weights=distance, minlength=4)
+    return {
+        "total": float(times.sum()),
+        **{name: float(value) for name, value in zip(CATEGORIES, seconds)},
+        "moves": int(np.count_nonzero(kinds != WAIT)),
+        "pen_lifts": int(np.count_nonzero((category == 2) & (targets[:, 2] > start[:, 2]))),
+        "draw_length": float(lengths[0]),
+        "travel_length": float(lengths[1]),
+    }
+
+
+# ===========================================================
+# Public Interface
+# ===========================================================
+def estimate_program(text, pen_z=PEN_Z, **limits):
+    """
+    Estimate the cycle time of a KRL program.
+
+    Parameters:
+      text (str, bytes or list of str): The program, e.g. the output of
+                                        converter.generate_krl_script.
+      pen_z (float): Height below which a move draws.
+      limits: Motion limits, see simulate.
+
+    Returns:
+      dict: The time breakdown, see breakdown.
+    """
+    kinds, targets, approximated, waits = parse_program(text)
+    times, distance = simulate(kinds, targets, approximated, waits, **limits)
+    return breakdown(kinds, targets, times, distance, pen_z)
+
+
+def estimate_file(filename, pen_z=PEN_Z, **limits):
+    """Like estimate_program, but memory-maps the file instead of reading it."""
+    if os.path.getsize(filename) == 0:
+        return estimate_program(b"", pen_z, **limits)
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as text:
+        return estimate_program(text, pen_z, **limits)
+
+
+def estimate_contours(contours, motion=converter.MOTION, wait=converter.PEN_WAIT,
+                      home=(converter.HOME_X, converter.HOME_Y), **limits):
+    """
+    Estimate the cycle time of the program converter.iter_krl_script writes
+    for contours in robot coordinates, without formatting and parsing it.
+    The contours are drawn as given, without smoothing and resampling.
+
+    Parameters:
+      contours (ContourSet or list of np.array): (N,2) arrays of points in
+                                                 the robot coordinate system.
+      motion (str): "lin" or "spline" drawing moves, see
+                    converter.iter_krl_script.
+      wait (float): Seconds waited after lowering the pen.
+      home (tuple): Home position the program starts and ends at.
+      limits: Motion limits, see simulate.
+
+    Returns:
+      dict: The time breakdown, see breakdown.
+    """
+    contours = ContourSet.from_list([c for c in contours if len(c) > 0])
+    lengths = contours.lengths
+    # Per contour: PTP to the start, LIN down, WAIT, LIN or SPL to every further point, LIN up
+    counts = lengths + 3
+    n = int(counts.sum())
+    owner = np.repeat(np.arange(len(contours)), counts)
+    step = np.arange(n) - np.repeat(np.cumsum(counts) - counts, counts)
+    point = contours.offsets[owner] + np.clip(step - 2, 0, lengths[owner] - 1)
+    last = step == counts[owner] - 1
+
+    draw = SPL if motion == "spline" else LIN
+    kinds = np.select([step == 0, step == 2, (step >= 3) & ~last], [PTP, WAIT, draw], LIN).astype(np.int8)
+    targets = np.empty((n, 3))
+    targets[:, :2] = contours.coords[point] if n else np.empty((0, 2))
+    targets[:, 2] = np.where((step == 0) | last, converter.TRAVEL_Z, converter.DRAW_Z)
+    approximated = (step >= 3) & ~last
+    waits = np.where(step == 2, wait, 0.0)
+
+    home_pose = np.array([[home[0], home[1], converter.TRAVEL_Z]])
+    kinds = np.concatenate(([PTP], kinds, [PTP])).astype(np.int8)
+    targets = np.vstack((home_pose, targets, home_pose))
+    approximated = np.concatenate(([False], approximated, [False]))
+    waits = np.concatenate(([0.0], waits, [0.0]))
+    times, distance = simulate(kinds, targets, approximated, waits, **limits)
+    return breakdown(kinds, targets, times, distance)
+
+
+def format_duration(seconds):
+    """Seconds as e.g. "1 h 02 min", "4 min 12 s" or "8.5 s"."""
+    if seconds >= 3600:
+        return f"{int(seconds // 3600)} h {int(seconds % 3600 // 60):02d} min"
+    if seconds >= 60:
+        return f"{int(seconds // 60)} min {int(seconds % 60):02d} s"
+    return f"{seconds:.1f} s"
+
+
+def format_estimate(estimate):
+    """One line summary of a time breakdown."""
+    return (f"{format_duration(estimate['total'])} (drawing {format_duration(estimate['draw'])}, "
+            f"travel {format_duration(estimate['travel'])}, pen up and down {format_duration(estimate['pen'])} "
+            f"for {estimate['pen_lifts']} lifts, waits {format_duration(estimate['wait'])})")
+
+
+# ===========================================================
+# Main Script Execution
+# ===========================================================
+def main():
+    parser = argparse.ArgumentParser(description="Estimate the cycle time of KRL drawing programs.")
+    parser.add_argument("programs", nargs="+", help="KRL .src files")
+    parser.add_argument("--lin-velocity", type=float, default=LIN_VELOCITY, help="LIN velocity in mm/s")
+    parser.add_argument("--lin-acceleration", type=float, default=LIN_ACCELERATION,
+                        help="LIN acceleration in mm/s^2")
+    parser.add_argument("--ptp-velocity", type=float, default=PTP_VELOCITY, help="PTP velocity in mm/s")
+    parser.add_argument("--ptp-acceleration", type=float, default=PTP_ACCELERATION,
+                        help="PTP acceleration in mm/s^2")
+    parser.add_argument("--approximation", type=float, default=APPROXIMATION,
+                        help="approximation distance of C_DIS moves in mm")
+    args = parser.parse_args()
+
+    limits = dict(lin_velocity=args.lin_velocity, lin_acceleration=args.lin_acceleration,
+                  ptp_velocity=args.ptp_velocity, ptp_acceleration=args.ptp_acceleration,
+                  approximation=args.approximation)
+    for filename in args.programs:
+        estimate = estimate_file(filename, **limits)
+        print(f"{filename}: {format_estimate(estimate)}, {estimate['moves']} moves, "
+              f"{estimate['draw_length']:.0f} mm drawn, {estimate['travel_length']:.0f} mm travelled")
+
+
+if __name__ == "__main__":
+    main()
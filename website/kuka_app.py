@@ -1,32 +1,44 @@
+import base64
 import os
-from io import BytesIO
+import zipfile
+from io import BytesIO, RawIOBase
 from pathlib import Path
 
 import plotly
-from flask import render_template, request, redirect, url_for, send_file, session, Blueprint, current_app
+from flask import render_template, request, redirect, url_for, session, Blueprint, current_app, send_file, Response
 import plotly.express as px
 import plotly.io as pio
 import numpy as np
+from PIL import Image
 
 import website.kuka.plotter as kuka_plotter
 import website.kuka.converter
-from website.image_stuff.image_conversion import process_image
+from website.kuka import simulator
+from website.image_stuff import sweep, tiled
+from website.image_stuff.image_conversion import process_image, process_preview, image_hash, CONTOUR_BACKENDS
+from website.artifact_store import ArtifactStore, ARTIFACT_TTL
+from website.contour_set import ContourSet
+from website.history import History, HISTORY_DEPTH
+from website.jobs import JobQueue
+from website.result_cache import ResultCache
 
 kuka_app = Blueprint('kuka_app', __name__, template_folder=Path(__file__).parent.joinpath("templates"))
 
 
 @kuka_app.route('/')
 def index():
-    if 'krl_script' not in session:
-        session['krl_script'] = ""
+    # Sessions from before the artifact store held the artifacts themselves
+    for key in ('contours', 'krl_script', 'fig'):
+        session.pop(key, None)
     if 'preprocessing_options' not in session:
         session['preprocessing_options'] = {
             'blur_intensity': 9,
             'threshold_block_size': 7,
-            'threshold_C': 4
+            'threshold_C': 4,
+            'backend': 'skimage'
         }
-    if 'history' not in session:
-        session['history'] = []
+    if not isinstance(session.get('history'), History):
+        session['history'] = History(current_app.config.get('HISTORY_DEPTH', HISTORY_DEPTH))
     if 'convert_options' not in session:
         session['convert_options'] = {
             "x": 210.0,  # Default scale X
@@ -36,12 +48,19 @@ def index():
             "preset_size": "a4",  # Default to A4
             "base": 3,  # Default base id
             "tool": 3,  # Default tool id
-            "step": 2  # Default step size for robot movements
+            "step": 2,  # Default step size for robot movements
+            "optimize": False,  # Default contour order
+            "tolerance": 0.0,  # Default max deviation for adaptive resampling (0 = fixed step size)
+            "overlap_tolerance": 0.0,  # Default max distance of overlapping strokes to remove (0 = keep all)
+            "chain_gap": 0.0,  # Default max gap between contours drawn as one stroke (0 = draw every contour alone)
+            "motion": "lin"  # Default drawing moves ("lin" or "spline")
         }
 
     return render_template(
         'index.html',
-        krl_script=session['krl_script'],
+        krl_script=session_krl_script(),
+        cycle_time=simulator.format_estimate(session['cycle_time']) if session.get('cycle_time') else None,
+        preview='preview' in session,
         preprocessing_options=session['preprocessing_options'],
         convert_options=session['convert_options']
     )
@@ -54,13 +73,19 @@ def upload():
         file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], file.filename)
         file.save(file_path)
         # Reset session variables related to the plot
-        if "redo_stack" in session:
-            del session["redo_stack"]
-        if "fig" in session:
-            del session["fig"]
+        discard_figures()
+        cancel_conversion()
         session["file"] = file_path
+        session["image_digest"] = image_hash(file_path)
 
-        session["update_plots"] = True
+        if preview_enabled():
+            # Contours and script of the previous image are replaced by a preview of the new one
+            session.pop('contours_id', None)
+            session.pop('krl_id', None)
+            session.pop('cycle_time', None)
+            update_preview()
+        else:
+            session["update_plots"] = True
 
         return redirect(url_for('kuka_app.index'))
     return 'Invalid file format. Please upload a PNG or JPEG file.'
@@ -69,6 +94,10 @@ def upload():
 @kuka_app.route('/update_preprocessing', methods=['POST'])
 def update_preprocessing():
     update_process()
+    if preview_enabled():
+        update_preview()
+    else:
+        session["update_plots"] = True
     return redirect(url_for('kuka_app.index'))
 
 
@@ -76,39 +105,140 @@ def update_preprocessing():
 def plot(plot_type):
     if session.get("update_plots", False):
         session["update_plots"] = False
-        if "fig" in session:
-            del session["fig"]
-        do_contours()
-        do_convert()
+        session["update_path"] = False
+        discard_figures()
+        start_conversion(with_contours=True)
 
     if session.get("update_path", False):
         session["update_path"] = False
-        do_convert()
-        del session["fig"]["path"]
+        start_conversion(with_contours=False)
 
-    if 'fig' in session and plot_type in session['fig']:
-        fig = plotly.io.from_json(session['fig'][plot_type])
-    else:
+    apply_job_results()
+
+    fig = session_figure(plot_type)
+    if fig is None and 'preview' in session:
+        fig = px.line()
+        plot_preview(fig, plot_type)
+        set_session_figure(plot_type, fig)
+    elif fig is None:
         fig = px.line()
         if plot_type == "cont":
-            if points := session.get('contours', []):
-                kuka_plotter.plot_cont(points, fig=fig, show=False)
+            if points := session_contours():
+                kuka_plotter.plot_cont(points, fig=fig, show=False, visible=visible_mask(),
+                                       webgl=current_app.config.get('PLOT_WEBGL', False))
         elif plot_type == "path":
-            if script := session.get('krl_script', ""):
-                points = kuka_plotter.extract(script.split("\n"))
-                kuka_plotter.plot_path(points, fig=fig, show=False)
-        if not "fig" in session:
-            session['fig'] = {}
-        session['fig'][plot_type] = fig.to_json()
+            if script := session_krl_script():
+                points = kuka_plotter.extract(script)
+                kuka_plotter.plot_path(points, fig=fig, show=False, webgl=current_app.config.get('PLOT_WEBGL', False))
+        set_session_figure(plot_type, fig)
     plot_html = pio.to_html(fig, full_html=False, div_id="myDiv", include_plotlyjs="cdn")
     return plot_html
 
 
-@kuka_app.route('/update_fig', methods=['POST'])
-def update_fig():
-    session['fig']["cont"] = request.json.get('fig')
+@kuka_app.route('/jobs/current', methods=['GET'])
+def current_job():
+    """Progress of the conversion of this session. Results are applied to the session as they are ready."""
+    job = apply_job_results()
+    if job is None:
+        return {"status": "none"}
+    return {**job.to_dict(), "applied": session['job_applied']}
+
+
+@kuka_app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    if job_id != session.get('job_id') or (job := job_queue().get(job_id)) is None:
+        return 'Unknown job', 404
+    return job.to_dict()
 
-    session["update_path"] = True
+
+@kuka_app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if job_id != session.get('job_id'):
+        return 'Unknown job', 404
+    job_queue().cancel(job_id)
+    return '', 204
+
+
+@kuka_app.route('/sweep', methods=['POST'])
+def start_sweep():
+    """
+    Evaluate a grid of preprocessing parameters for the session's image in the background. Takes lists of
+    blur_intensity, threshold_block_size and threshold_C values, and optionally a target_length in mm.
+    """
+    if "file" not in session:
+        return 'No image uploaded', 400
+    grid = request.get_json(silent=True) or {}
+    options = session['preprocessing_options']
+    convert = session['convert_options']
+    try:
+        blurs = [int(v) for v in grid.get('blur_intensity', [options['blur_intensity']])]
+        block_sizes = [int(v) for v in grid.get('threshold_block_size', [options['threshold_block_size']])]
+        cs = [int(v) for v in grid.get('threshold_C', [options['threshold_C']])]
+        target_length = float(grid['target_length']) if grid.get('target_length') is not None else None
+        sweep.settings_grid(blurs, block_sizes, cs)
+    except (TypeError, ValueError) as e:
+        return f'Invalid parameter grid: {e}', 400
+
+    if job_id := session.get('sweep_job_id'):
+        job_queue().cancel(job_id)
+    job = job_queue().submit(sweep_job, session["file"], blurs, block_sizes, cs,
+                             backend=options.get('backend', 'skimage'), scale=(convert['x'], convert['y']),
+                             border=convert['border'], mode=convert['mode'], step=convert['step'],
+                             tolerance=convert.get('tolerance', 0.0) or None,
+                             workers=current_app.config.get('SWEEP_WORKERS'), target_length=target_length,
+                             stages=("sweep",))
+    session['sweep_job_id'] = job.id
+    return {"id": job.id}, 202
+
+
+@kuka_app.route('/sweep/<job_id>', methods=['GET'])
+def sweep_status(job_id):
+    """Progress of a sweep, and once done its results with the thumbnails as PNG data URLs."""
+    if job_id != session.get('sweep_job_id') or (job := job_queue().get(job_id)) is None:
+        return 'Unknown job', 404
+    status = job.to_dict()
+    if job.status == "done":
+        results, best = job.result
+        status["results"] = [dict(r, thumbnail="data:image/png;base64," + base64.b64encode(r["thumbnail"]).decode())
+                             for r in results]
+        status["best"] = results.index(best) if best is not None else None
+    return status
+
+
+@kuka_app.route('/visibility', methods=['GET'])
+def visibility():
+    mask = visible_mask()
+    return {"count": len(mask), "enabled": np.flatnonzero(mask).tolist()}
+
+
+@kuka_app.route('/visibility', methods=['POST'])
+def update_visibility():
+    """Apply visibility changes given as lists of contour indices to enable, disable or toggle."""
+    if 'preview' in session:
+        return 'Contours can be removed after converting', 409
+    changes = request.get_json(silent=True) or {}
+    mask = visible_mask().copy()
+    try:
+        for op in ("enable", "disable", "toggle"):
+            idx = np.asarray(changes.get(op, []), dtype=int)
+            if np.any((idx < 0) | (idx >= len(mask))):
+                return 'Contour index out of range', 400
+            match op:
+                case "enable":
+                    mask[idx] = True
+                case "disable":
+                    mask[idx] = False
+                case "toggle":
+                    mask[idx] = ~mask[idx]
+    except (TypeError, ValueError):
+        return 'Contour indices must be lists of integers', 400
+
+    if not np.array_equal(mask, session['visible']):
+        cancel_conversion()
+        session['visible'] = mask
+        # The stored contour plot shows the old visibility
+        discard_figures("cont")
+        session["update_path"] = True
 
     return '', 204
 
@@ -124,95 +254,428 @@ def convert():
 
 @kuka_app.route('/update_krl', methods=['POST'])
 def update_krl():
-    session['krl_script'] = request.form['krl_script']
+    set_session_krl_script(request.form['krl_script'])
     return '', 204
 
 
 @kuka_app.route('/download_krl')
 def download_krl():
-    output = BytesIO()
-    output.write(session['krl_script'].encode('utf-8'))
-    output.seek(0)
-    return send_file(output, as_attachment=True, download_name="draw.src", mimetype="text/plain")
+    # Streamed from the artifact store without reading the script into memory
+    script = artifact_store().open(session['krl_id']) if session.get('krl_id') else None
+    return send_file(script or BytesIO(), mimetype="text/plain", as_attachment=True, download_name="draw.src")
+
+
+@kuka_app.route('/download_krl_parts')
+def download_krl_parts():
+    # The script split into a master program, a resume entry point and parts, zipped while they are sent
+    try:
+        modules = website.kuka.converter.split_krl_script(session_krl_script(),
+                                                          current_app.config.get('KRL_PART_POINTS'),
+                                                          current_app.config.get('KRL_PART_BYTES'))
+    except ValueError as e:
+        return str(e), 400
+    return Response(iter_zip(modules), mimetype="application/zip",
+                    headers={"Content-Disposition": "attachment; filename=draw.zip"})
 
 
 @kuka_app.route('/undo', methods=['POST'])
 def undo():
-    if 'history' in session and session['history']:
-        if 'redo_stack' not in session:
-            session['redo_stack'] = []
-        session['redo_stack'].append((session['contours'].copy(), session['preprocessing_options'].copy(),
-                                      session["convert_options"].copy()))
-        session['contours'], session['preprocessing_options'], session["convert_options"] = session['history'].pop()
+    history = session.get('history')
+    if isinstance(history, History) and (state := history.undo()) is not None:
+        if not restore_state(*state):
+            history.redo()
+        session['history'] = history
     return redirect(url_for('kuka_app.index'))
 
 
 @kuka_app.route('/redo', methods=['POST'])
 def redo():
-    if 'redo_stack' in session and session['redo_stack']:
-        if 'history' not in session:
-            session['history'] = []
-        session['history'].append((session['contours'].copy(), session['preprocessing_options'].copy(),
-                                   session["convert_options"].copy()))
-        session['contours'], session['preprocessing_options'], session["convert_options"] = session['redo_stack'].pop()
+    history = session.get('history')
+    if isinstance(history, History) and (state := history.redo()) is not None:
+        if not restore_state(*state):
+            history.undo()
+        session['history'] = history
     return redirect(url_for('kuka_app.index'))
 
 
-def do_contours():
-    points = process_image(session["file"],
-                           session['preprocessing_options']['blur_intensity'],
-                           session['preprocessing_options']['threshold_block_size'],
-                           session['preprocessing_options']['threshold_C'])
-
-    session['contours'] = points
-    session['history'].append((points.copy(), session['preprocessing_options'].copy()))
-
-
-def do_convert():
-    if not "fig" in session or not "cont" in session["fig"]:
-        plot("cont")
-    fig = plotly.io.from_json(session["fig"]["cont"])
-    visible_contours_idx = []
-    for trace in fig['data']:
-        if trace["mode"] == "lines":
-            if "Contour" not in trace['name']:
-                continue
-            if 'visible' not in trace or trace['visible'] != 'legendonly':
-                try:
-                    contour_index = int(trace['name'].split(' ')[1]) - 1
-                    visible_contours_idx.append(contour_index)
-                except (IndexError, ValueError) as e:
-                    print(f"Error processing trace name: {trace['name']}, error: {e}")
+def result_cache():
+    # One instance per process, it counts the bytes written since its last eviction sweep
+    if 'kuka_results' not in current_app.extensions:
+        current_app.extensions['kuka_results'] = ResultCache(current_app.config.get('RESULT_CACHE_FOLDER', 'cache'),
+                                                             current_app.config.get('RESULT_CACHE_MAX_BYTES',
+                                                                                    512 * 1024 * 1024))
+    return current_app.extensions['kuka_results']
 
-    # Get the contours that are currently visible
-    visible_contours = [np.array(session['contours'][idx]) for idx in visible_contours_idx]
 
-    scale_x = session['convert_options']['x']
-    scale_y = session['convert_options']['y']
-    border = session['convert_options']['border']
-    mode = session['convert_options']['mode']
-    base = session['convert_options']['base']
-    tool = session['convert_options']['tool']
-    step = session['convert_options']['step']
+def artifact_store():
+    if 'kuka_artifacts' not in current_app.extensions:
+        current_app.extensions['kuka_artifacts'] = ArtifactStore(current_app.config.get('ARTIFACT_FOLDER', 'artifacts'),
+                                                                 current_app.config.get('ARTIFACT_TTL', ARTIFACT_TTL))
+    return current_app.extensions['kuka_artifacts']
+
+
+def session_contours():
+    """The session's contours memory-mapped from the artifact store, empty if there are none."""
+    contours_id = session.get('contours_id')
+    contours = artifact_store().get_contours(contours_id) if contours_id else None
+    return contours if contours is not None else ContourSet.from_list([])
+
 
-    krl_script = website.kuka.converter.generate_krl_script(visible_contours, save=False,
-                                                            scale=np.array([scale_x, scale_y]),
-                                                            border=np.array([border, border]), mode=mode, base_id=base,
-                                                            tool_id=tool, step=step)
-    session['krl_script'] = "\n".join(krl_script)
+def set_session_contours(contours):
+    session['contours_id'] = artifact_store().put_contours(contours)
+
+
+def session_krl_script():
+    krl_id = session.get('krl_id')
+    return (artifact_store().get_text(krl_id) if krl_id else None) or ""
+
+
+def set_session_krl_script(krl_script, cycle_time=None):
+    """Store the session's KRL script and its cycle time estimate, which is estimated here unless given."""
+    session['krl_id'] = artifact_store().put_text(krl_script, ".src") if krl_script else None
+    if krl_script and cycle_time is None:
+        cycle_time = simulator.estimate_program(krl_script, **current_app.config.get('MOTION_LIMITS', {}))
+    session['cycle_time'] = cycle_time if krl_script else None
+
+
+def session_figure(plot_type):
+    """The stored figure of a plot, None if it has to be plotted."""
+    fig_id = session.get('fig_ids', {}).get(plot_type)
+    fig_json = artifact_store().get_text(fig_id) if fig_id else None
+    return plotly.io.from_json(fig_json) if fig_json is not None else None
+
+
+def set_session_figure(plot_type, fig):
+    session['fig_ids'] = {**session.get('fig_ids', {}), plot_type: artifact_store().put_text(fig.to_json(), ".json")}
+
+
+def discard_figures(*plot_types):
+    """Forget the stored figures of the given plots, of all plots if none are given."""
+    if plot_types:
+        session['fig_ids'] = {k: v for k, v in session.get('fig_ids', {}).items() if k not in plot_types}
+    else:
+        session.pop('fig_ids', None)
+
+
+class _ZipStream(RawIOBase):
+    """An unseekable file the zip archive is written to, collecting the bytes until they are sent."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def iter_zip(files):
+    """Zip (name, text) files one at a time and yield the archive in pieces, without holding it in memory."""
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, text in files:
+            archive.writestr(name, text)
+            yield stream.pop()
+    yield stream.pop()
+
+
+def image_digest():
+    if 'image_digest' not in session:
+        session['image_digest'] = image_hash(session["file"])
+    return session['image_digest']
+
+
+def visible_mask():
+    """Per contour flag whether it is converted, all contours by default."""
+    count = len(session_contours())
+    mask = session.get('visible')
+    if mask is None or len(mask) != count:
+        mask = np.ones(count, dtype=bool)
+        session['visible'] = mask
+    return mask
+
+
+def job_queue():
+    if 'kuka_jobs' not in current_app.extensions:
+        current_app.extensions['kuka_jobs'] = JobQueue(current_app.config.get('JOB_WORKERS', 2))
+    return current_app.extensions['kuka_jobs']
+
+
+def cancel_conversion():
+    if job_id := session.get('job_id'):
+        job_queue().cancel(job_id)
+
+
+def start_conversion(with_contours=True):
+    """Start the conversion of the session's image in the background, replacing a running one."""
+    if "file" not in session:
+        return
+    cancel_conversion()
+    job = job_queue().submit(conversion_job,
+                             image_path=session["file"],
+                             digest=image_digest(),
+                             preprocessing=conversion_preprocessing(session["file"], session['preprocessing_options']),
+                             convert=dict(session['convert_options']),
+                             contours=None if with_contours else session_contours(),
+                             visible=None if with_contours else visible_mask(),
+                             cache=result_cache(),
+                             workers=current_app.config.get('SMOOTHING_WORKERS'),
+                             tile_workers=current_app.config.get('TILE_WORKERS'),
+                             motion_limits=current_app.config.get('MOTION_LIMITS', {}))
+    session['job_id'] = job.id
+    session['job_applied'] = []
+
+
+def apply_job_results():
+    """Copy the results of the session's conversion job into the session once they are ready."""
+    job = job_queue().get(session.get('job_id', ''))
+    if job is None or job.cancelled:
+        return job
+    applied = list(session.get('job_applied', []))
+
+    if "contours" in job.partial and "contours" not in applied:
+        points = job.partial["contours"]
+        discard_preview()
+        set_session_contours(points)
+        session['visible'] = np.ones(len(points), dtype=bool)
+        history = session.get('history')
+        if not isinstance(history, History):
+            history = History(current_app.config.get('HISTORY_DEPTH', HISTORY_DEPTH))
+        history.record(job.partial["contours_key"], history_options())
+        session['history'] = history
+        discard_figures("cont")
+        applied.append("contours")
+
+    if job.status == "done" and "krl_script" not in applied:
+        set_session_krl_script(job.result["krl_script"], job.result["cycle_time"])
+        discard_figures("path")
+        applied.append("krl_script")
+
+    session['job_applied'] = applied
+    return job
+
+
+def history_options():
+    """The options of the session's contours, as recorded in the history."""
+    return {
+        "image": {"file": session["file"], "digest": image_digest()},
+        "preprocessing": dict(session['preprocessing_options']),
+        "convert": dict(session['convert_options']),
+    }
+
+
+def restore_state(contours_key, options):
+    """
+    Restore the contours and options of a history entry. Contours dropped from the result cache are recomputed
+    if their image is still there. Returns False if the entry cannot be restored.
+    """
+    image = options["image"]
+    cache = result_cache()
+    contours = cache.get_contours(contours_key)
+    if contours is None:
+        if not os.path.exists(image["file"]) or image_hash(image["file"]) != image["digest"]:
+            print(f"Cannot restore the contours of {image['file']}, the image has changed")
+            return False
+        preprocessing = conversion_preprocessing(image["file"], options["preprocessing"])
+        contours = compute_contours(image["file"], image["digest"], preprocessing, cache,
+                                    current_app.config.get('TILE_WORKERS'))
+
+    cancel_conversion()
+    discard_preview()
+    session["file"] = image["file"]
+    session["image_digest"] = image["digest"]
+    session['preprocessing_options'] = options["preprocessing"]
+    session['convert_options'] = options["convert"]
+    set_session_contours(contours)
+    session['visible'] = np.ones(len(contours), dtype=bool)
+    discard_figures()
+    # The KRL script and the path are generated again for the restored contours
+    session["update_path"] = True
+    return True
+
+
+def conversion_preprocessing(image_path, preprocessing):
+    """The preprocessing options of a conversion, with the tile size if the image is processed in tiles."""
+    preprocessing = dict(preprocessing)
+    if tile_size := tile_size_for(image_path):
+        # Tiled contours differ slightly from the ones of the whole image, so they are cached apart
+        preprocessing['tile_size'] = tile_size
+    return preprocessing
+
+
+def tile_size_for(image_path):
+    """Size of the tiles an image is processed in, or None to process it as a whole."""
+    tiled_pixels = current_app.config.get('TILED_MIN_PIXELS')
+    if not tiled_pixels:
+        return None
+    with Image.open(image_path) as image:
+        width, height = image.size
+    return current_app.config.get('TILE_SIZE', tiled.TILE_SIZE) if width * height >= tiled_pixels else None
+
+
+def preview_enabled():
+    return bool(current_app.config.get('PREVIEW_MAX_SIZE')) and "file" in session
+
+
+def update_preview():
+    """
+    Replace the preview with the contours of the session's image at preview resolution. The preview is kept
+    apart from the converted contours and KRL script, which only a conversion replaces.
+    """
+    options = dict(session['preprocessing_options'])
+    contours = process_preview(session["file"],
+                               options['blur_intensity'],
+                               options['threshold_block_size'],
+                               options['threshold_C'],
+                               backend=options.get('backend', 'skimage'),
+                               max_size=current_app.config['PREVIEW_MAX_SIZE'])
+    session['preview'] = {"contours_id": artifact_store().put_contours(contours), "preprocessing_options": options}
+    discard_figures()
+
+
+def discard_preview():
+    if session.pop('preview', None) is not None:
+        discard_figures()
+
+
+def plot_preview(fig, plot_type):
+    """Plot the preview contours, or their path scaled to the drawing area without smoothing and resampling."""
+    points = artifact_store().get_contours(session['preview']['contours_id'])
+    if points is None:
+        points = ContourSet.from_list([])
+    webgl = current_app.config.get('PLOT_WEBGL', False)
+    if len(points) == 0:
+        fig.update_layout(title="Preview: no contours found")
+    elif plot_type == "cont":
+        kuka_plotter.plot_cont(points, fig=fig, show=False, webgl=webgl)
+        fig.update_layout(title="Preview: " + fig.layout.title.text)
+    elif plot_type == "path":
+        convert = session['convert_options']
+        points = website.kuka.converter.scale_contours(points, np.array([convert['x'], convert['y']]),
+                                                       np.array([convert['border'], convert['border']]),
+                                                       convert['mode'])
+        kuka_plotter.plot_path(points, fig=fig, show=False, webgl=webgl)
+        fig.update_layout(title="Preview: " + fig.layout.title.text)
+
+
+def conversion_job(job, image_path, digest, preprocessing, convert, contours, visible, cache, workers,
+                   tile_workers=None, motion_limits=None):
+    """
+    Extract the contours of an image unless they are given, then generate the
+    KRL script of the visible ones and estimate its cycle time. Runs without
+    access to the session.
+    """
+    if contours is None:
+        contours = compute_contours(image_path, digest, preprocessing, cache, tile_workers, progress=job.report)
+        visible = np.ones(len(contours), dtype=bool)
+        job.publish("contours_key", contours_key(cache, digest, preprocessing))
+        job.publish("contours", contours)
+    else:
+        for stage in ("load", "threshold", "extract"):
+            job.report(stage)
+
+    krl_script = compute_krl_script(contours, np.flatnonzero(visible).tolist(), digest, preprocessing, convert, cache,
+                                    workers, progress=job.report)
+    return {"krl_script": krl_script,
+            "cycle_time": simulator.estimate_program(krl_script, **(motion_limits or {})) if krl_script else None}
+
+
+def sweep_job(job, image_path, blurs, block_sizes, cs, **options):
+    return sweep.sweep(image_path, blurs, block_sizes, cs, progress=job.report, **options)
+
+
+def contours_key(cache, digest, preprocessing):
+    """Key the contours of an image are stored under in the result cache."""
+    return cache.key("contours", digest, **preprocessing)
+
+
+def compute_contours(image_path, digest, preprocessing, cache, tile_workers=None, progress=None):
+    key = contours_key(cache, digest, preprocessing)
+    points = cache.get_contours(key)
+    if points is None and preprocessing.get('tile_size'):
+        points = tiled.process_image_tiled(image_path,
+                                           preprocessing['blur_intensity'],
+                                           preprocessing['threshold_block_size'],
+                                           preprocessing['threshold_C'],
+                                           backend=preprocessing.get('backend', 'skimage'),
+                                           tile_size=preprocessing['tile_size'],
+                                           workers=tile_workers,
+                                           progress=progress)
+        cache.put_contours(key, points)
+    elif points is None:
+        points = process_image(image_path,
+                               preprocessing['blur_intensity'],
+                               preprocessing['threshold_block_size'],
+                               preprocessing['threshold_C'],
+                               backend=preprocessing.get('backend', 'skimage'),
+                               progress=progress)
+        cache.put_contours(key, points)
+    elif progress:
+        for stage in ("load", "threshold", "extract"):
+            progress(stage, 1.0)
+    return points
+
+
+def compute_krl_script(contours, visible_contours_idx, digest, preprocessing, convert, cache, workers=None,
+                       progress=None):
+    key = cache.key("krl", digest, preprocessing=preprocessing, convert=convert, visible=visible_contours_idx)
+    if (krl_script := cache.get_text(key)) is not None:
+        if progress:
+            progress("smooth", 1.0)
+            progress("emit", 1.0)
+        return krl_script
+
+    # Get the contours that are currently visible
+    visible_contours = ContourSet.from_list(contours).select(visible_contours_idx)
+
+    scale_x = convert['x']
+    scale_y = convert['y']
+    border = convert['border']
+    mode = convert['mode']
+    base = convert['base']
+    tool = convert['tool']
+    step = convert['step']
+    optimize = convert.get('optimize', False)
+    tolerance = convert.get('tolerance', 0.0) or None
+    overlap_tolerance = convert.get('overlap_tolerance', 0.0) or None
+    chain_gap = convert.get('chain_gap', 0.0) or None
+    motion = convert.get('motion', 'lin')
+
+    krl_chunks = website.kuka.converter.iter_krl_script(visible_contours,
+                                                        scale=np.array([scale_x, scale_y]),
+                                                        border=np.array([border, border]), mode=mode, base_id=base,
+                                                        tool_id=tool, step=step, optimize=optimize,
+                                                        tolerance=tolerance, overlap_tolerance=overlap_tolerance,
+                                                        chain_gap=chain_gap, motion=motion, workers=workers,
+                                                        progress=progress)
+    # The session keeps the script without the trailing newline of the file format.
+    krl_script = "".join(krl_chunks)[:-1]
+    cache.put_text(key, krl_script)
+    return krl_script
 
 
 def update_process():
-    session["update_plots"] = True
+    cancel_conversion()
 
     session['preprocessing_options'] = {
         'blur_intensity': int(request.form.get('blur_intensity', 9)),
         'threshold_block_size': int(request.form.get('threshold_block_size', 7)),
-        'threshold_C': int(request.form.get('threshold_C', 4))
+        'threshold_C': int(request.form.get('threshold_C', 4)),
+        'backend': request.form.get('backend', 'skimage')
     }
+    if session['preprocessing_options']['backend'] not in CONTOUR_BACKENDS:
+        session['preprocessing_options']['backend'] = 'skimage'
 
 
 def update_conversion():
+    cancel_conversion()
     session["update_plots"] = True
 
     session["convert_options"] = {
@@ -224,5 +687,12 @@ def update_conversion():
         "base": request.form.get("base", 3),
         "tool": request.form.get("tool", 3),
         "step": float(request.form.get("step", 2)),
+        "optimize": request.form.get("optimize") == "on",
+        "tolerance": float(request.form.get("tolerance") or 0),
+        "overlap_tolerance": float(request.form.get("overlap_tolerance") or 0),
+        "chain_gap": float(request.form.get("chain_gap") or 0),
+        "motion": request.form.get("motion", "lin"),
     }
+    if session['convert_options']['motion'] not in website.kuka.converter.MOTION_MODES:
+        session['convert_options']['motion'] = 'lin'
 
@@ -0,0 +1,133 @@
+"""
+A content-addressed disk cache for contours and generated KRL scripts.
+
+Results are stored under the SHA-256 of the image bytes and the options
+that produced them, so the same image uploaded again, by any session, is
+served without recomputation. The cache only uses atomic file operations,
+which makes it safe to share one cache directory between several worker
+processes: files are written to a temporary name and renamed into place,
+and a file removed by another process is treated as a cache miss. When the
+directory grows beyond its size budget, the least recently used files are
+deleted. Scanning the directory takes longer the larger the cache, so like
+the cleanup of the artifact store the sweep runs at most once per interval
+across all processes, or earlier when a process has written a share of the
+budget since its last sweep.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from website.contour_set import ContourSet
+
+EVICT_INTERVAL = 300  # Min seconds between two sweeps of the cache
+EVICT_SLACK = 0.1  # Share of the budget written by one process after which it sweeps regardless of the interval
+
+
+class ResultCache:
+
+    def __init__(self, directory: str, max_bytes: int, evict_interval: float = EVICT_INTERVAL,
+                 evict_slack: float = EVICT_SLACK):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self.evict_slack = evict_slack
+        self._written = 0  # Bytes written by this instance since its last sweep
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(kind: str, image_digest: str, **options) -> str:
+        """Content address of a result from the image hash and all options that affect it."""
+        description = json.dumps({"kind": kind, "image": image_digest, "options": options}, sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def _read(self, key: str, suffix: str, read):
+        path = self._path(key, suffix)
+        try:
+            with open(path, "rb") as f:
+                value = read(f)
+            os.utime(path)  # Mark as recently used
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key: str, suffix: str, write) -> None:
+        path = self._path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._written += size
+        self.maybe_evict()
+
+    def get_contours(self, key: str) -> ContourSet | None:
+        return self._read(key, ".npy", ContourSet.load)
+
+    def put_contours(self, key: str, contours: ContourSet) -> None:
+        self._write(key, ".npy", ContourSet.from_list(contours).save)
+
+    def get_text(self, key: str) -> str | None:
+        text = self._read(key, ".src", lambda f: f.read())
+        return None if text is None else text.decode("utf-8")
+
+    def put_text(self, key: str, text: str) -> None:
+        self._write(key, ".src", lambda f: f.write(text.encode("utf-8")))
+
+    def maybe_evict(self) -> None:
+        """Evict if no process did so within the interval, or if this one wrote a share of the budget since."""
+        marker = os.path.join(self.directory, ".evict")
+        if self._written < self.max_bytes * self.evict_slack:
+            try:
+                if os.stat(marker).st_mtime > time.time() - self.evict_interval:
+                    return
+            except FileNotFoundError:
+                pass
+        # Another process evicting at the same time does no harm, removals of missing files are ignored
+        with open(marker, "w"):
+            pass
+        self._written = 0
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete the least recently used results until the cache fits its size budget."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if path == os.path.join(self.directory, ".evict"):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith(".tmp"):
+                    # Being written by another process, or left over by a crashed one
+                    if stat.st_mtime < time.time() - 3600:
+                        self._remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # Already evicted by another process